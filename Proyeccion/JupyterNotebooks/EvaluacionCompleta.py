@@ -10,6 +10,7 @@ import pandas as pd
 from Metodos.AutoARIMA import auto_arima_predict
 from Metodos.IndividualANN import individual_ann_predict
 from Metodos.FuzzyTimeSeries import hyperopt_fts_predict
+from Metodos.GlobalAR import global_ar_predict
 
 # Importar Normalizadores
 from Metodos.Normalizators import MinMaxNormalizator, DummyNormalizator, DifferencingNormalizator
@@ -20,6 +21,8 @@ from Evaluation import Model, TestResult
 DATASET_NAME = 'TodasLasEscuelas'
 GROUP_DATASET_NAME = 'TodosLosGrupos'
 SCHOOLS = 3011
+# Número de procesos entre los que se reparten las escuelas de NAR, ARIMA y FTS
+WORKERS = os.cpu_count()
 
 def combine(results) :
     assert(len(results))
@@ -47,12 +50,16 @@ if __name__ == '__main__' :
     nar = Model(individual_ann_predict, args = dict(window_len = 5, normalizators = [MinMaxNormalizator]))
     arima = Model(auto_arima_predict, args = dict(normalizators = [MinMaxNormalizator]))
     fts = Model(hyperopt_fts_predict, args = dict(normalizators = [MinMaxNormalizator]))
+    # Un solo modelo autorregresivo entrenado con los datos históricos de todas
+    # las escuelas del conjunto
+    global_ar = Model(global_ar_predict, args = dict(window_len = 5), batch = True)
     
     # Calcular predicciones con NAR
     result_nar = nar.test_set(
         dataset_name = DATASET_NAME,
         prediction_size = 5,
-        group_dataset = GROUP_DATASET_NAME
+        group_dataset = GROUP_DATASET_NAME,
+        workers = WORKERS
     )
     result_nar.Y = np.reshape(result_nar.Y, (SCHOOLS, 5)).T
     result_nar.Y_hat = np.reshape(result_nar.Y_hat, (SCHOOLS, 5)).T
@@ -61,7 +68,8 @@ if __name__ == '__main__' :
     result_arima = arima.test_set(
         dataset_name = DATASET_NAME,
         prediction_size = 5,
-        group_dataset = GROUP_DATASET_NAME
+        group_dataset = GROUP_DATASET_NAME,
+        workers = WORKERS
     )
     result_arima.Y = np.reshape(result_arima.Y, (SCHOOLS, 5)).T
     result_arima.Y_hat = np.reshape(result_arima.Y_hat, (SCHOOLS, 5)).T
@@ -70,11 +78,21 @@ if __name__ == '__main__' :
     result_fts = fts.test_set(
         dataset_name = DATASET_NAME,
         prediction_size = 5,
-        group_dataset = GROUP_DATASET_NAME
+        group_dataset = GROUP_DATASET_NAME,
+        workers = WORKERS
     )
     result_fts.Y = np.reshape(result_fts.Y, (SCHOOLS, 5)).T
     result_fts.Y_hat = np.reshape(result_fts.Y_hat, (SCHOOLS, 5)).T
     
+    # Calcular predicciones con el modelo autorregresivo global
+    result_global_ar = global_ar.test_set(
+        dataset_name = DATASET_NAME,
+        prediction_size = 5,
+        group_dataset = GROUP_DATASET_NAME
+    )
+    result_global_ar.Y = np.reshape(result_global_ar.Y, (SCHOOLS, 5)).T
+    result_global_ar.Y_hat = np.reshape(result_global_ar.Y_hat, (SCHOOLS, 5)).T
+    
     # Calcular predicciones ARIMA + NAR
     result_arima_nar = combine([result_arima, result_nar])
     
@@ -94,3 +112,4 @@ if __name__ == '__main__' :
     print("Metricas FTS + NAR", result_fts_nar.metricas, end = '\n\n')
     print("Metricas FTS + ARIMA", result_fts_arima.metricas, end = '\n\n')
     print("Metricas FTS + ARIMA + NAR", result_fts_arima_nar.metricas, end = '\n\n')
+    print("Metricas AR global", result_global_ar.metricas, end = '\n\n')
@@ -4,12 +4,54 @@ currentdir = os.path.dirname(os.path.realpath(__file__))
 parentdir = os.path.dirname(currentdir)
 sys.path.append(parentdir)
 
+import multiprocessing
 import numpy as np
 import pandas as pd
 from Metodos.LinearRegression import linear_regression_predict, base_linear_regression
 from Metodos.AutoARIMA import auto_arima_predict
 from Metodos.IndividualANN import individual_ann_predict
 from Metodos.Normalizators import MinMaxNormalizator, DummyNormalizator, DifferencingNormalizator
+from Metodos.Metrics import compute_metrics
+from Metodos.ThreadLimits import limit_threads
+
+def predecir_bloque(tarea) :
+    """Predice un bloque de escuelas en un proceso del pool de Model.test_set.
+    
+    Args:
+        tarea (tuple): tupla (function, args, indices, observaciones,
+            prediction_size) con la función y los parámetros del modelo, las
+            columnas de las escuelas del bloque, sus datos históricos y el
+            número de años a predecir.
+    
+    Returns:
+        indices (list): columnas de las escuelas del bloque.
+        (:obj: `numpy.array`): numpy array con la predicción de cada escuela
+            del bloque con dimensiones (len(indices), prediction_size).
+    """
+    function, args, indices, observaciones, prediction_size = tarea
+    prediccion = np.zeros((len(indices), prediction_size))
+    for j, ob_X in enumerate(observaciones) :
+        prediccion[j] = function(data = ob_X, prediction_size = prediction_size, **args)
+    return indices, prediccion
+
+class Progreso :
+    """Reporta el avance de una evaluación cada vez que se completa un
+    porcentaje de las escuelas, en lugar de imprimir una línea por escuela.
+    """
+    
+    def __init__(self, total, porcentaje = 5) :
+        self.total = total
+        self.terminadas = 0
+        self.paso = max(1, int(total * porcentaje / 100))
+        self.siguiente = self.paso
+    
+    def avanzar(self, escuelas = 1) :
+        self.terminadas += escuelas
+        if self.terminadas >= self.siguiente or self.terminadas == self.total :
+            print("Escuelas terminadas: %d de %d (%.0f%%)" % (
+                self.terminadas, self.total, 100 * self.terminadas / self.total))
+            while self.siguiente <= self.terminadas :
+                self.siguiente += self.paso
 
 class TestResult :
     """Clase que contiene los resultados de las métricas de evaluación. La clase
@@ -39,29 +81,12 @@ class TestResult :
         """
         
         self.groups = groups
-        self.metricas = []
-        for i in range(prediction.shape[0]) :
-            tmp_pred = prediction[i]
-            tmp_Y = Y[i]
-            tmp_group = groups[i]
-
-            # Mean absolute error
-            mae = np.abs(tmp_pred - tmp_Y).mean()
-
-            # Root mean squared error
-            rmse = np.sqrt(np.square(tmp_pred - tmp_Y).mean())
-
-            # Mean absolute percentage error
-            mape = np.abs((tmp_pred - tmp_Y) / tmp_Y).mean()
-            
-            # Probabilidad de riesgo
-            # Alternativa A de la Probabilidad de riesgo
-            #pr = (np.abs(np.abs(tmp_pred - tmp_Y)) >= tmp_Y / tmp_group).mean()
-            
-            # Alternativa B de la probabilidad de riesgo
-            pr = (np.abs(tmp_pred - tmp_Y) >= tmp_group).mean()
-            
-            self.metricas.append((mae, rmse, mape, pr))
+        
+        # Métricas de todos los años en una sola operación. La probabilidad de
+        # riesgo utiliza la alternativa B: |ŷ - y| >= grupos. La alternativa A
+        # era |ŷ - y| >= y / grupos.
+        mae, rmse, mape, pr = compute_metrics(Y, prediction, groups)
+        self.metricas = list(zip(mae, rmse, mape, pr))
         
         m = Y.shape[0] * Y.shape[1]
         self.Y_hat = np.reshape(prediction.T, m)
@@ -74,7 +99,7 @@ class Model :
     que ya calculó previamente.
     """
     
-    def __init__(self, function, args = dict()) :
+    def __init__(self, function, args = dict(), batch = False) :
         """Constructor de la clase Model.
         
         Args:
@@ -84,10 +109,15 @@ class Model :
             args (:obj: `dict`): parámetro opcional para los modelos que 
                 utilicen parámetros extra aparte de los datos y el tamaño de 
                 predicción.
+            batch (bool, opcional): si es True function predice todas las 
+                escuelas del conjunto en una sola llamada: recibe una lista con
+                las series de tiempo y devuelve una matriz con una predicción
+                por renglón, por ejemplo Metodos/GlobalAR.global_ar_predict.
         """
         
         self.model_function = function
         self.args = args
+        self.batch = batch
         
         self.cached_sets = dict()
         
@@ -111,8 +141,64 @@ class Model :
         self.args['data'] = data
         
         return self.model_function(**self.args)
-       
-    def test_set(self, dataset_name, prediction_size, group_dataset) :
+    
+    def predict_batch(self, data, prediction_size) :
+        """Método que realiza la predicción de varias observaciones de datos
+        en una sola llamada a la función del modelo, ver batch.
+        
+        Args:
+            data (list): lista de numpy arrays con los valores de cada serie
+                de tiempo.
+            prediction_size (int): número de valores o años que se quiere predecir.
+        
+        Returns:
+             (:obj: `numpy.array`): numpy array con los valores de la predicción
+                con dimensiones (len(data), prediction_size).
+        """
+        
+        self.args['prediction_size'] = prediction_size
+        self.args['data'] = data
+        
+        return np.array(self.model_function(**self.args))
+    
+    def predict_pool(self, observaciones, prediction_size, workers, Y_hat) :
+        """Método que realiza la predicción de varias observaciones de datos
+        repartiéndolas en bloques entre un pool de procesos. Cada predicción se
+        escribe en la columna de Y_hat de su observación.
+        
+        Los procesos se crean con el método spawn: las funciones que utilizan
+        tensorflow no funcionan en procesos creados con fork si el proceso
+        principal ya lo importó.
+        
+        Args:
+            observaciones (list): lista de numpy arrays con los valores de cada
+                serie de tiempo.
+            prediction_size (int): número de valores o años que se quiere predecir.
+            workers (int): número de procesos.
+            Y_hat (:obj: `numpy.array`): numpy array en el que se escriben las
+                predicciones con dimensiones (prediction_size, len(observaciones)).
+        """
+        
+        # Parámetros del modelo sin los datos de predicciones anteriores
+        args = {llave : valor for llave, valor in self.args.items()
+            if llave not in ('data', 'prediction_size')}
+        
+        # Bloques pequeños para que los procesos terminen al mismo tiempo
+        num_bloques = min(len(observaciones), workers * 8)
+        tareas = [
+            (self.model_function, args, list(indices), [observaciones[i] for i in indices], prediction_size)
+            for indices in np.array_split(np.arange(len(observaciones)), num_bloques)
+        ]
+        
+        print("Evaluando con %d procesos" % (workers))
+        progreso = Progreso(len(observaciones))
+        contexto = multiprocessing.get_context('spawn')
+        with contexto.Pool(processes = workers, initializer = limit_threads) as pool :
+            for indices, prediccion in pool.imap_unordered(predecir_bloque, tareas) :
+                Y_hat[:, indices] = prediccion.T
+                progreso.avanzar(len(indices))
+    
+    def test_set(self, dataset_name, prediction_size, group_dataset, workers = 1) :
         """Método que evalúa un conjunto de datos con el modelo que guarda
         esta clase.
         
@@ -122,6 +208,11 @@ class Model :
             prediction_size (int): número de años a predecir.
             group_dataset (str): nombre del dataset que contiene el número de grupos
                 para cada cct del dataset a evaluar.
+            workers (int, opcional): número de procesos entre los que se reparten
+                las escuelas. Las predicciones se colocan en la columna de su
+                escuela, por lo que el resultado no depende del número de
+                procesos. Los modelos por lotes (batch = True) predicen todas
+                las escuelas en una sola llamada y no utilizan este parámetro.
         
         Returns:
             (:obj: `TestResult`): instancia de la clase TestResult con los 
@@ -158,6 +249,9 @@ class Model :
             # Grupos (para métrica de probabilidad de riesgo)
             group_data = np.zeros((prediction_size, num_escuelas))
             
+            # Observaciones de todas las escuelas
+            observaciones = []
+            
             # Indica la columna en la que se colocará la observación
             for i in range(num_escuelas) :
                 # Escuela
@@ -190,14 +284,23 @@ class Model :
                     ob_Y = row[-self.TEST_SIZE :]
                 else :
                     ob_Y = row[-self.TEST_SIZE : -(self.TEST_SIZE - prediction_size)]
-                # Predicción de los datos
-                ob_Y_hat = self.predict(ob_X, prediction_size)
-                
-                Y_hat[:, i] = ob_Y_hat
                 Y[:, i] = ob_Y
                 group_data[:, i] = group_val
-                
-                print("Escuela %d de %d terminada" % (i + 1, num_escuelas))
+                observaciones.append(np.array(ob_X, dtype = np.float64))
+            
+            if self.batch :
+                # Predicción de todas las escuelas en una sola llamada
+                Y_hat[:, :] = self.predict_batch(observaciones, prediction_size).T
+                print("%d escuelas terminadas" % (num_escuelas))
+            elif workers == 1 :
+                progreso = Progreso(num_escuelas)
+                for i, ob_X in enumerate(observaciones) :
+                    # Predicción de los datos
+                    Y_hat[:, i] = self.predict(ob_X, prediction_size)
+                    progreso.avanzar()
+            else :
+                self.predict_pool(observaciones, prediction_size, workers, Y_hat)
+            
             self.cached_sets[key] = TestResult(Y_hat, Y, group_data)
         
         return self.cached_sets[key]
@@ -0,0 +1,72 @@
+import os
+import pickle
+import hashlib
+import numpy as np
+
+def series_hash(data) :
+	"""Calcula una huella de los datos de una serie de tiempo. Sirve para saber
+	si los artefactos guardados de una escuela corresponden a su serie actual.
+
+	Args:
+		data (:obj: `numpy.array`): numpy array con los valores reales de la
+			serie de tiempo con dimensiones (n,).
+
+	Returns:
+		(str): huella hexadecimal de la serie de tiempo.
+	"""
+	return hashlib.sha1(np.asarray(data, dtype = np.float64).tobytes()).hexdigest()
+
+class ArtifactStore :
+	"""Almacén en disco de los artefactos entrenados de cada serie de tiempo.
+
+	Un artefacto es un diccionario con la huella de la serie de tiempo con la
+	que fue entrenado (llave 'hash') y los artefactos de cada método, por
+	ejemplo los pesos de la red neuronal, el modelo ARIMA ajustado o los
+	hiperparámetros de FTS. Cada artefacto se guarda en un archivo pickle
+	independiente dentro del directorio del almacén.
+	"""
+
+	def __init__(self, directory = '.artefactos_proyeccion') :
+		self.directory = directory
+		os.makedirs(directory, exist_ok = True)
+
+	def path(self, key) :
+		"""Devuelve la ruta del archivo del artefacto con la llave key."""
+		return os.path.join(self.directory, '%s.pkl' % key)
+
+	def load(self, key) :
+		"""Carga el artefacto con la llave key.
+
+		Args:
+			key (str): llave del artefacto, por ejemplo el cct de la escuela.
+
+		Returns:
+			(dict): el artefacto guardado o None si no existe o no se puede leer.
+		"""
+		try :
+			with open(self.path(key), 'rb') as archivo :
+				return pickle.load(archivo)
+		except Exception :
+			return None
+
+	def save(self, key, artifacts) :
+		"""Guarda el artefacto con la llave key. La escritura es atómica, se
+		escribe un archivo temporal y después se reemplaza el anterior.
+
+		Args:
+			key (str): llave del artefacto, por ejemplo el cct de la escuela.
+			artifacts (dict): artefacto a guardar.
+		"""
+		ruta = self.path(key)
+		ruta_temporal = '%s.%d.tmp' % (ruta, os.getpid())
+		with open(ruta_temporal, 'wb') as archivo :
+			pickle.dump(artifacts, archivo)
+			archivo.flush()
+			os.fsync(archivo.fileno())
+		os.replace(ruta_temporal, ruta)
+
+if __name__ == '__main__' :
+	escuela = np.array([89,127,134,152,170,172,182,192,197,210,219,222,233,226,222,205,222])
+	store = ArtifactStore()
+	store.save('ejemplo', {'hash': series_hash(escuela)})
+	print(store.load('ejemplo')['hash'] == series_hash(escuela))
@@ -5,21 +5,84 @@ parentdir = os.path.dirname(currentdir)
 sys.path.append(parentdir)
 
 import numpy as np
-from pmdarima.arima import auto_arima
+from pmdarima.arima import auto_arima, ARIMA
 from Metodos.Normalizators import MinMaxNormalizator
 
-def train_auto_arima(data) :
+def fit_arima_neighbourhood(data, order, with_intercept = True, max_p = 7, max_q = 7) :
+	"""Función que ajusta el modelo ARIMA con el orden (p, d, q) dado y sus
+	vecinos (p ± 1, d, q) y (p, d, q ± 1), y devuelve el de menor AIC. El orden
+	dado también se ajusta con y sin intercepto.
+	
+	Args:
+	    data (:obj: `numpy.array`): arreglo con los datos de la serie de tiempo
+	        con dimensión (n,).
+		order (tuple): orden (p, d, q) alrededor del cual se busca.
+		with_intercept (bool, opcional): si los vecinos incluyen intercepto.
+		max_p (int, opcional): valor máximo de p.
+		max_q (int, opcional): valor máximo de q.
+	
+	Returns:
+	    model (:obj: `pmdarima.arima.arima.ARIMA`): mejor modelo ARIMA de la
+	    	vecindad o None si ninguno pudo ajustarse.
+	"""
+	p, d, q = order
+	best_model = None
+	candidates = [
+		(p, q, with_intercept),
+		(p, q, not with_intercept),
+		(p - 1, q, with_intercept),
+		(p + 1, q, with_intercept),
+		(p, q - 1, with_intercept),
+		(p, q + 1, with_intercept)
+	]
+	for new_p, new_q, intercept in candidates :
+		if not (0 <= new_p <= max_p and 0 <= new_q <= max_q) :
+			continue
+		try :
+			model = ARIMA(
+				order = (new_p, d, new_q),
+				with_intercept = intercept,
+				suppress_warnings = True
+			).fit(data)
+		except Exception :
+			continue
+		if best_model is None or model.aic() < best_model.aic() :
+			best_model = model
+	return best_model
+
+def train_auto_arima(data, start_order = None, with_intercept = True, criterion = None, tolerance = 0.1) :
 	"""Función para entrenar un nuevo modelo ARIMA. Encuentra los mejores parámetros
 	p, d, q, P, D, Q que minimizan el error en la predicción.
 	
+	Si se proporciona el orden (p, d, q) de un modelo entrenado previamente, 
+	únicamente se evalúa la vecindad de ese orden, ver fit_arima_neighbourhood.
+	La búsqueda completa se realiza solo si el AIC por observación del mejor
+	modelo de la vecindad es peor que el del modelo previo por más de 
+	tolerance.
+	
 	Args:
 	    data (:obj: `numpy.array`): arreglo con los datos de la serie de tiempo
 	        con dimensión (n,).
+		start_order (tuple, opcional): orden (p, d, q) de un modelo entrenado
+			previamente con la misma serie de tiempo.
+		with_intercept (bool, opcional): si el modelo entrenado previamente
+			incluye intercepto.
+		criterion (float, opcional): AIC por observación del modelo entrenado
+			previamente, ver arima_criterion.
+		tolerance (float, opcional): incremento máximo permitido del AIC por
+			observación respecto a criterion antes de realizar la búsqueda 
+			completa.
 	
 	Returns:
 	    model (:obj: `pmdarima.arima.arima.ARIMA`): modelo ARIMA entrenado
 	
 	"""
+	if start_order is not None :
+		model = fit_arima_neighbourhood(data, start_order, with_intercept)
+		if model is not None and (criterion is None or 
+			arima_criterion(model, data) <= criterion + tolerance) :
+			return model
+	
 	# Asignar el valor máximo de los parámetros p,d,q,P,D,Q
 	model = auto_arima(
 		y = data,
@@ -43,6 +106,21 @@ def train_auto_arima(data) :
 	)
 	return model
 
+def arima_criterion(model, data) :
+	"""Función que calcula el AIC por observación de un modelo ARIMA. Permite
+	comparar modelos entrenados con series de tiempo de distinta longitud, por
+	ejemplo cuando se agrega un nuevo año a la serie.
+	
+	Args:
+		model (:obj: `pmdarima.arima.arima.ARIMA`): modelo ARIMA entrenado.
+		data (:obj: `numpy.array`): arreglo con los datos con los que se
+			entrenó el modelo con dimensión (n,).
+	
+	Returns:
+		(float): AIC del modelo dividido entre el número de observaciones.
+	"""
+	return model.aic() / len(data)
+
 def auto_arima_predict(data, prediction_size, normalizators = []) :
 	"""Realiza una predicción utilizando el modelo ARIMA luego de encontrar los
 	parámetros de p, d y q que mejor modelen a la serie de tiempo.
@@ -76,7 +154,57 @@ def auto_arima_predict(data, prediction_size, normalizators = []) :
 		prediction = norms[i].denormalize(prediction)
 	return prediction
 
-def evaluate_and_predict_arima(data, prediction_size = 5, normalizators = [MinMaxNormalizator], OFFSET_ANIOS = 5) :
+def update_arima(artifact, raw_data, data, drift_threshold = 3.0) :
+	"""Función que actualiza el modelo ARIMA guardado en artifact con las 
+	nuevas observaciones de la serie de tiempo, sin volver a buscar sus 
+	parámetros ni ajustarlo desde cero.
+	
+	La actualización solo es posible si la serie de tiempo con la que se ajustó
+	el modelo es el inicio de la serie actual y si las nuevas observaciones se
+	encuentran dentro del rango de la serie anterior, de modo que la 
+	normalización (p. ej. MinMaxNormalizator) no cambia. Tampoco se actualiza
+	si alguna observación nueva se aleja del pronóstico del modelo por más de 
+	drift_threshold veces la desviación estándar de sus residuos.
+	
+	Args:
+		artifact (dict): artefacto de evaluate_and_predict_arima con las llaves
+			'model' y 'data'.
+		raw_data (:obj: `numpy.array`): serie de tiempo actual sin normalizar 
+			con dimensiones (n,).
+		data (:obj: `numpy.array`): serie de tiempo actual normalizada con 
+			dimensiones (n,).
+		drift_threshold (float, opcional): número de desviaciones estándar de
+			los residuos a partir del cual se considera que la serie cambió.
+	
+	Returns:
+		model (:obj: `pmdarima.arima.arima.ARIMA`): modelo actualizado o None si
+			no es posible actualizarlo y debe entrenarse de nuevo.
+	"""
+	if 'model' not in artifact or 'data' not in artifact :
+		return None
+	
+	old_data = artifact['data']
+	n = len(old_data)
+	if len(raw_data) <= n or not np.array_equal(raw_data[:n], old_data) :
+		return None
+	
+	# El rango de la serie cambió, por lo que también la normalización
+	new_data = raw_data[n:]
+	if new_data.min() < old_data.min() or new_data.max() > old_data.max() :
+		return None
+	
+	# Verificar que las nuevas observaciones sigan el comportamiento del modelo
+	model = artifact['model']
+	forecast = model.predict(n_periods = len(new_data))
+	sigma = np.std(model.resid())
+	if np.any(np.abs(data[n:] - forecast) > drift_threshold * sigma) :
+		return None
+	
+	model.update(data[n:])
+	return model
+
+def evaluate_and_predict_arima(data, prediction_size = 5, normalizators = [MinMaxNormalizator], OFFSET_ANIOS = 5, 
+	artifact = None, train = True) :
 	"""Función que devuelve la predicción de los datos históricos y los datos
 	futuros aplicando el modelo ARIMA.
 	
@@ -93,6 +221,19 @@ def evaluate_and_predict_arima(data, prediction_size = 5, normalizators = [MinMa
 			función pueda ser utilizada junto con IndividualANN en la opinión de
 			expertos, pero si esta función se va a utilizar por sí sola no hace
 			falta remover ningún año.
+		artifact (dict, opcional): diccionario en el que se guardan el modelo
+			ARIMA ajustado con la llave 'model', su orden (p, d, q) con la 
+			llave 'order', si incluye intercepto con la llave 'with_intercept'
+			y su AIC por observación con la llave 'criterion'. También se 
+			guarda la serie de tiempo sin normalizar con la llave 'data'.
+			Ver Metodos/ArtifactStore.
+		train (bool, opcional): si es False y artifact contiene un modelo, la
+			predicción se realiza con ese modelo sin volver a ajustarlo. Si es
+			True y artifact contiene el orden de un modelo previo, la búsqueda
+			de los parámetros se limita a la vecindad de ese orden, ver 
+			train_auto_arima. Si además la serie de tiempo solo agrega nuevas
+			observaciones a la serie guardada, el modelo guardado se actualiza
+			con ellas, ver update_arima.
 	
 	Returns:
 		prediction (:obj: `numpy.array`): arreglo con la predicción futura con
@@ -100,6 +241,8 @@ def evaluate_and_predict_arima(data, prediction_size = 5, normalizators = [MinMa
 		train_prediction (:obj: `numpy.array`): arreglo con la predicción histórica
 			con dimensiones (n - OFFSET_ANIOS,).
 	"""
+	raw_data = np.array(data, dtype = np.float64)
+	
 	# Aplicar las normalizaciones
 	norms = []
 	for i in range(len(normalizators)) :
@@ -107,8 +250,29 @@ def evaluate_and_predict_arima(data, prediction_size = 5, normalizators = [MinMa
 		data = normalizator.normalize(data)
 		norms.append(normalizator)
 	
-	# Entrenar el modelo
-	model = train_auto_arima(data)
+	if not train and artifact is not None and 'model' in artifact :
+		# Utilizar el modelo guardado
+		model = artifact['model']
+	else :
+		if artifact is None :
+			artifact = dict()
+		
+		# Actualizar el modelo previo con las nuevas observaciones
+		model = update_arima(artifact, raw_data, data)
+		
+		if model is None :
+			# Entrenar el modelo partiendo del orden previo si existe
+			model = train_auto_arima(
+				data,
+				start_order = artifact.get('order'),
+				with_intercept = artifact.get('with_intercept', True),
+				criterion = artifact.get('criterion')
+			)
+		artifact['data'] = raw_data
+		artifact['model'] = model
+		artifact['order'] = model.order
+		artifact['with_intercept'] = model.with_intercept
+		artifact['criterion'] = arima_criterion(model, data)
 	
 	# Obtener predicción futura
 	prediction = model.predict(n_periods = prediction_size)
@@ -4,7 +4,10 @@ currentdir = os.path.dirname(os.path.realpath(__file__))
 parentdir = os.path.dirname(currentdir)
 sys.path.append(parentdir)
 
+import copy
+import time
 import numpy as np
+from multiprocessing import TimeoutError
 from Metodos.IndividualANN import individual_ann_predict, evaluate_and_predict_ann
 from Metodos.FuzzyTimeSeries import hyperopt_fts_predict, evaluate_and_predict_fts
 from Metodos.AutoARIMA import auto_arima_predict, evaluate_and_predict_arima
@@ -36,8 +39,27 @@ def weightless_ep_predict(data, prediction_size, experts = []) :
 		
 	return global_prediction / len(experts)
 
+def run_expert(expert, args) :
+	"""Función que ejecuta un experto y devuelve su predicción junto con su 
+	artefacto. Es una función del módulo para que pueda ejecutarse en otro 
+	proceso, en cuyo caso el artefacto actualizado por el experto es una copia
+	y tiene que devolverse al proceso principal.
+	
+	Args:
+		expert (function): función del método experto.
+		args (dict): parámetros del experto.
+	
+	Returns:
+		prediction (:obj: `numpy.array`): predicción futura del experto.
+		train_prediction (:obj: `numpy.array`): predicción histórica del experto.
+		artifact (dict): artefacto del experto o None si no se proporcionó.
+	"""
+	prediction, train_prediction = expert(**args)
+	return prediction, train_prediction, args.get('artifact')
+
 def evaluate_and_predict_ep(data, prediction_size = 5, 
-	experts = [evaluate_and_predict_ann, evaluate_and_predict_arima, evaluate_and_predict_fts]) :
+	experts = [evaluate_and_predict_ann, evaluate_and_predict_arima, evaluate_and_predict_fts],
+	artifacts = None, train = True, pool = None, timeout = None, finished_experts = None, precomputed = None) :
 	"""Función que devuelve la predicción de los datos históricos y los datos
 	futuros aplicando Opinión de Expertos.
 	
@@ -49,6 +71,33 @@ def evaluate_and_predict_ep(data, prediction_size = 5,
 			Por defecto se utiliza el modelo ARIMA, FTS y ANN. Las normalzaciones
 			se aplican en las funciones individuales de cada uno como parámetros
 			por defecto.
+		artifacts (dict, opcional): diccionario en el que cada experto guarda
+			sus artefactos entrenados, indexados por el nombre de la función del
+			experto. Ver Metodos/ArtifactStore.
+		train (bool, opcional): si es False los expertos realizan la predicción
+			con los artefactos guardados en artifacts sin entrenar.
+		pool (:obj: `multiprocessing.pool.Pool`, opcional): pool de procesos en 
+			el que los expertos se ejecutan de forma concurrente. Debe tener al 
+			menos un proceso libre por experto, de modo que todos comiencen al
+			enviarse, y utilizar el método de inicio spawn, porque TensorFlow 
+			se bloquea en los procesos creados con fork después de 
+			inicializarse. Si no se proporciona los expertos se ejecutan uno 
+			tras otro.
+		timeout (float, opcional): segundos que se espera a los expertos desde
+			que se envían al pool. Los expertos que no terminan a tiempo se 
+			descartan del promedio y sus artefactos no se actualizan, pero 
+			siguen ocupando su proceso: si algún experto no terminó, quien 
+			creó el pool debe detenerlo con terminate antes de volver a 
+			utilizarlo. Solo se utiliza junto con pool.
+		finished_experts (list, opcional): lista a la que se agregan los 
+			nombres de las funciones de los expertos que terminaron y que 
+			forman parte del promedio.
+		precomputed (dict, opcional): resultados de expertos calculados 
+			previamente, por ejemplo las redes neuronales de varias escuelas
+			entrenadas juntas con evaluate_and_predict_ann_batch. Los 
+			resultados son tuplas (prediction, train_prediction, artifact), 
+			ver run_expert, indexadas por el nombre de la función del experto.
+			Estos expertos no se ejecutan.
 	
 	Returns:
 		global_prediction (:obj: `numpy.array`): arreglo con la predicción futura con
@@ -60,15 +109,216 @@ def evaluate_and_predict_ep(data, prediction_size = 5,
 	global_prediction = np.zeros((prediction_size))
 	global_train_prediction = np.zeros((len(data) - 5))
 	
+	if precomputed is None :
+		precomputed = dict()
+	
+	experts_args = []
 	for expert in experts :
+		if expert.__name__ in precomputed :
+			experts_args.append(None)
+			continue
 		args = dict()
 		args['data'] = data
 		args['prediction_size'] = prediction_size
-		prediction, train_prediction = expert(**args)
+		if artifacts is not None :
+			# Cada experto trabaja sobre una copia completa de su artefacto, de
+			# modo que un experto descartado no modifique artifacts después de
+			# terminar, por ejemplo el modelo ARIMA que se actualiza en su lugar
+			args['artifact'] = copy.deepcopy(artifacts.get(expert.__name__, dict()))
+			args['train'] = train
+		experts_args.append(args)
+	
+	if pool is None :
+		results = [
+			precomputed[expert.__name__] if args is None else run_expert(expert, args)
+			for expert, args in zip(experts, experts_args)
+		]
+	else :
+		pending = [
+			None if args is None else pool.apply_async(run_expert, (expert, args))
+			for expert, args in zip(experts, experts_args)
+		]
+		
+		# Todos los expertos comparten el mismo límite de tiempo porque 
+		# comienzan al mismo tiempo
+		deadline = None if timeout is None else time.monotonic() + timeout
+		results = []
+		for expert, result in zip(experts, pending) :
+			if result is None :
+				results.append(precomputed[expert.__name__])
+				continue
+			try :
+				results.append(result.get(None if deadline is None else max(deadline - time.monotonic(), 0)))
+			except TimeoutError :
+				# Descartar a los expertos que no terminaron a tiempo
+				results.append(None)
+		
+		if all(result is None for result in results) :
+			raise TimeoutError("Ningún experto terminó en %s segundos" % (timeout))
+	
+	finished = 0
+	for expert, result in zip(experts, results) :
+		if result is None :
+			continue
+		prediction, train_prediction, artifact = result
+		if artifacts is not None :
+			artifacts[expert.__name__] = artifact
 		global_prediction += prediction
 		global_train_prediction += train_prediction
+		finished += 1
+		if finished_experts is not None :
+			finished_experts.append(expert.__name__)
 	
-	return global_prediction / len(experts), global_train_prediction / len(experts)
+	return global_prediction / finished, global_train_prediction / finished
+
+# Costo aproximado en segundos de entrenar a cada experto, se utiliza para
+# ordenarlos en evaluate_and_predict_ep_budgeted y respetar su presupuesto
+EXPERT_COSTS = {
+	'evaluate_and_predict_arima' : 1.0,
+	'evaluate_and_predict_fts' : 1.5,
+	'evaluate_and_predict_ann' : 8.0
+}
+
+# Nombre corto de cada experto
+EXPERT_LABELS = {
+	'evaluate_and_predict_arima' : 'ARIMA',
+	'evaluate_and_predict_fts' : 'FTS',
+	'evaluate_and_predict_ann' : 'ANN'
+}
+
+def series_statistics(data) :
+	"""Función que calcula estadísticas sencillas de una serie de tiempo que
+	se utilizan para decidir cuántos expertos entrenar. El ruido es relativo al
+	nivel promedio de la serie, de modo que se pueden comparar escuelas de 
+	distinto tamaño. El ruido ya combina la varianza de la serie y la fuerza
+	de su tendencia lineal: su cuadrado es la varianza relativa por 1 - R², 
+	por lo que estas no se calculan por separado.
+	
+	Args:
+		data (:obj: `numpy.array`): numpy array con los valores reales de la
+			serie de tiempo con dimensiones (n,).
+	
+	Returns:
+		(dict): diccionario con las llaves:
+			- 'constancy': proporción de los años en los que la serie no 
+				cambió respecto al año anterior.
+			- 'noise': desviación estándar de los residuos de la regresión 
+				lineal entre el nivel promedio de la serie.
+	"""
+	data = np.asarray(data, dtype = np.float64)
+	scale = np.mean(np.abs(data))
+	if scale == 0 :
+		scale = 1.0
+	
+	x = np.arange(len(data))
+	slope, intercept = np.polyfit(x, data, 1)
+	residuals = data - (slope * x + intercept)
+	
+	return {
+		'constancy' : np.mean(np.diff(data) == 0),
+		'noise' : np.std(residuals) / scale
+	}
+
+def evaluate_and_predict_ep_budgeted(data, prediction_size = 5, 
+	experts = [evaluate_and_predict_ann, evaluate_and_predict_arima, evaluate_and_predict_fts],
+	tolerance = 0.01, budget = None, artifacts = None, train = True) :
+	"""Función que devuelve la predicción de los datos históricos y los datos
+	futuros aplicando Opinión de Expertos con un presupuesto de tiempo.
+	
+	Los expertos se entrenan del más barato al más costoso según EXPERT_COSTS.
+	El primero siempre se entrena, los siguientes solo si se espera que cambien
+	la predicción promedio en más de tolerance (relativo al nivel promedio de
+	la serie) y si su costo cabe en lo que resta del presupuesto.
+	
+	El cambio esperado al agregar el experto k + 1 es d / (k + 1), donde d es la
+	desviación absoluta promedio de las predicciones de los k expertos respecto
+	a su promedio. Con un solo experto d se estima con el ruido de la serie 
+	alrededor de su tendencia lineal, ver series_statistics, por lo que en las
+	series constantes o casi constantes solo se entrena el primer experto.
+	
+	Args:
+	    data (:obj: `numpy.array`): numpy array con los valores reales de la
+			serie de tiempo con dimensiones (n,).
+		prediction_size (int, opcional): número de años a predecir.
+		experts (list, opcional): lista de funciones con los métodos expertos,
+			ver evaluate_and_predict_ep.
+		tolerance (float, opcional): cambio relativo mínimo esperado de la 
+			predicción promedio para agregar un experto.
+		budget (float, opcional): segundos disponibles para la escuela. Si no
+			se proporciona no hay límite de tiempo.
+		artifacts (dict, opcional): ver evaluate_and_predict_ep. Además se 
+			guardan los nombres de los expertos entrenados con la llave 
+			'used_experts'.
+		train (bool, opcional): si es False se utilizan, sin entrenar, todos 
+			los expertos de 'used_experts' que tienen un artefacto guardado en
+			artifacts, porque predecir con ellos es barato. Si ninguno lo 
+			tiene se entrenan como si train fuera True.
+	
+	Returns:
+		global_prediction (:obj: `numpy.array`): arreglo con la predicción futura con
+			dimensiones (prediction_size,).
+		global_train_prediction (:obj: `numpy.array`): arreglo con la predicción histórica
+			con dimensiones (n - 5,).
+		used_experts (list): nombres cortos de los expertos utilizados en el 
+			orden en el que se entrenaron, ver EXPERT_LABELS.
+	"""
+	assert(len(data) > 5)
+	start = time.time()
+	experts = sorted(experts, key = lambda expert : EXPERT_COSTS.get(expert.__name__, 0.0))
+	
+	if not train and artifacts is not None :
+		# Los artefactos de los expertos que no se utilizaron en el último
+		# entrenamiento pueden corresponder a una serie de tiempo anterior
+		names = artifacts.get('used_experts', list(artifacts.keys()))
+		stored = [expert for expert in experts if expert.__name__ in names and expert.__name__ in artifacts]
+		if stored :
+			experts = stored
+			tolerance = -1.0
+			budget = None
+		else :
+			train = True
+	
+	statistics = series_statistics(data)
+	scale = np.mean(np.abs(data)) or 1.0
+	
+	predictions = []
+	train_predictions = []
+	used_experts = []
+	for expert in experts :
+		k = len(predictions)
+		if k :
+			# Cambio esperado de la predicción promedio al agregar este experto
+			if k == 1 :
+				deviation = 0.0 if statistics['constancy'] == 1 else statistics['noise']
+			else :
+				average = np.mean(predictions, axis = 0)
+				deviation = np.mean(np.abs(np.array(predictions) - average)) / scale
+			if deviation / (k + 1) <= tolerance :
+				break
+			
+			cost = EXPERT_COSTS.get(expert.__name__, 0.0)
+			if budget is not None and time.time() - start + cost > budget :
+				break
+		
+		args = dict()
+		args['data'] = data
+		args['prediction_size'] = prediction_size
+		if artifacts is not None :
+			# Copia completa, igual que en evaluate_and_predict_ep
+			args['artifact'] = copy.deepcopy(artifacts.get(expert.__name__, dict()))
+			args['train'] = train
+		prediction, train_prediction, artifact = run_expert(expert, args)
+		if artifacts is not None :
+			artifacts[expert.__name__] = artifact
+		
+		predictions.append(prediction)
+		train_predictions.append(train_prediction)
+		used_experts.append(EXPERT_LABELS.get(expert.__name__, expert.__name__))
+	
+	if artifacts is not None and train :
+		artifacts['used_experts'] = [expert.__name__ for expert in experts[:len(used_experts)]]
+	
+	return np.mean(predictions, axis = 0), np.mean(train_predictions, axis = 0), used_experts
 
 if __name__ == '__main__' :
 	escuela = np.array([89,127,134,152,170,172,182,192,197,210,219,222,233,226,222,205,222])
@@ -82,3 +332,6 @@ if __name__ == '__main__' :
 		]
 	)
 	print(prediccion)
+	
+	prediccion, _, expertos = evaluate_and_predict_ep_budgeted(escuela, budget = 10.0)
+	print(prediccion, expertos)
@@ -10,11 +10,32 @@ from pyFTS.models import pwfts, chen, hofts
 from pyFTS.common import Membership as mf
 from Metodos.Normalizators import MinMaxNormalizator
 
-def fts_train(data, fuzy_sets, membership_func, order, model, partitioner) :
-	"""Función para entrenar un modelo FTS dados los hiperparámetros del modelo.
+def build_partitioner(data, fuzy_sets, membership_func, partitioner) :
+	"""Función que construye la partición del universo de discurso de la serie
+	de tiempo en conjuntos difusos.
 	
-	Para más información acerca de los términos ver:
-	https://towardsdatascience.com/a-short-tutorial-on-fuzzy-time-series-dcc6d4eb1b15
+	Nota: pyFTS 1.6 lee la función de pertenencia del parámetro func e ignora
+	el parámetro mf, por lo que todas las particiones utilizan trimf sin 
+	importar el valor de membership_func. Se conserva el comportamiento 
+	original para no cambiar los resultados de las proyecciones.
+	
+	Args:
+		data (:obj: `numpy.array`): numpy array de una dimensión que contiene
+			los datos de entrenamiento de la serie de tiempo.
+		fuzy_sets(int): número de conjuntos (o términos lingüisticos) de los que 
+			se compondrá la variable lingüistica.
+		membership_func(:obj: `Membership.function`): función de pertenencia del 
+			modelo.
+		partitioner(:obj: `pyFTS.partitioners`): tipo de particionador a utilizar.
+	
+	Returns:
+		(:obj: `pyFTS.partitioners.*`): particionador con los conjuntos difusos.
+	"""
+	return partitioner(data = data, npart = fuzy_sets, mf = membership_func)
+
+def fts_build(data, fuzy_sets, membership_func, order, model, partitioner, shared_partitioner = None) :
+	"""Función que construye y ajusta un modelo FTS con los hiperparámetros
+	dados.
 	
 	Args:
 		data (:obj: `numpy.array`): numpy array de una dimensión que contiene
@@ -26,42 +47,338 @@ def fts_train(data, fuzy_sets, membership_func, order, model, partitioner) :
 		order(int): número de lags para considerar en la autoregresión.
 		model(:obj: `pyFTS.Models`): modelo FTS a utilizar.
 		partitioner(:obj: `pyFTS.partitioners`): tipo de particionador a utilizar.
+		shared_partitioner(:obj: `pyFTS.partitioners.*`, opcional): 
+			particionador construido previamente con los mismos datos, 
+			fuzy_sets, membership_func y partitioner, ver build_partitioner. Si
+			no se proporciona se construye uno nuevo.
 	
 	Returns:
-		error(float): MAPE del modelo FTS construido al predecir los datos de
-			entrenamiento.
-		prediction(:obj: `numpy.array`): arreglo numpy con los datos de la predicción
-			de los años futuros (no de los datos de entrenamiento) con forma 
-			(prediction__size,).
+		model (:obj: `pyFTS.models.*`): modelo FTS ajustado a los datos.
 	"""
-	assert(len(data) > 5)
 	# Crear partitioner
-	partitioner = partitioner(data = data, npart = fuzy_sets, mf = membership_func)
+	if shared_partitioner is None :
+		shared_partitioner = build_partitioner(data, fuzy_sets, membership_func, partitioner)
 	
 	# Crear modelo
-	model = model(order = order, partitioner = partitioner)
+	model = model(order = order, partitioner = shared_partitioner)
 	
 	# Entrenar modelo
 	model.fit(data)
 	
-	# Encontrar error histórico
-	y_hat = []
-	for i in range(5, len(data)) :
-		prediction = model.predict(data[:i], steps_ahead = 1)
-		y_hat.append(prediction[0])
+	return model
+
+def fts_rolling_predict(model, data, start = 5) :
+	"""Función que obtiene la predicción un paso adelante de cada año de los
+	datos de entrenamiento a partir del año start. La predicción de cada año 
+	utiliza únicamente los order años anteriores, y todas las predicciones se 
+	obtienen en una sola pasada sobre la serie de tiempo.
 	
-	y_hat = np.array(y_hat)
+	Args:
+		model (:obj: `pyFTS.models.*`): modelo FTS ajustado.
+		data (:obj: `numpy.array`): numpy array de una dimensión que contiene
+			los datos de entrenamiento de la serie de tiempo.
+		start (int, opcional): primer año a predecir, debe ser mayor o igual
+			al orden del modelo.
+	
+	Returns:
+		(:obj: `numpy.array`): arreglo con la predicción de los años start a 
+			n - 1 con dimensiones (n - start,).
+	"""
+	assert(start >= model.order)
+	# pyFTS predice el año siguiente de cada ventana de order años de la serie,
+	# según el modelo se incluye o no la predicción de la última ventana
+	prediction = model.predict(data[start - model.order :], steps_ahead = 1)
+	return np.array(prediction[: len(data) - start])
+
+def fts_train(data, fuzy_sets, membership_func, order, model, partitioner, shared_partitioner = None) :
+	"""Función para entrenar un modelo FTS dados los hiperparámetros del modelo.
+	
+	Para más información acerca de los términos ver:
+	https://towardsdatascience.com/a-short-tutorial-on-fuzzy-time-series-dcc6d4eb1b15
+	
+	Args:
+		data (:obj: `numpy.array`): numpy array de una dimensión que contiene
+			los datos de entrenamiento de la serie de tiempo.
+		fuzy_sets(int): número de conjuntos (o términos lingüisticos) de los que 
+			se compondrá la variable lingüistica.
+		membership_func(:obj: `Membership.function`): función de pertenencia del 
+			modelo.
+		order(int): número de lags para considerar en la autoregresión.
+		model(:obj: `pyFTS.Models`): modelo FTS a utilizar.
+		partitioner(:obj: `pyFTS.partitioners`): tipo de particionador a utilizar.
+		shared_partitioner(:obj: `pyFTS.partitioners.*`, opcional): ver 
+			fts_build.
+	
+	Returns:
+		error(float): MAPE del modelo FTS construido al predecir los datos de
+			entrenamiento.
+		model (:obj: `pyFTS.models.*`): modelo FTS ajustado a los datos.
+		train_prediction(:obj: `numpy.array`): arreglo numpy con la predicción 
+			de los datos de entrenamiento a partir del sexto año con forma 
+			(n - 5,), ver fts_rolling_predict.
+	"""
+	assert(len(data) > 5)
+	model = fts_build(data, fuzy_sets, membership_func, order, model, partitioner, shared_partitioner)
+	
+	# Encontrar error histórico
+	y_hat = fts_rolling_predict(model, data)
 	y = data[5:]
 	
 	# Calcular MAPE
 	error = np.abs((y_hat - y) / y).mean()
 	
-	return error, model
+	return error, model, y_hat
+
+# Hiperparámetros del Grid Search
+# TODO: conforme se agreguen más datos a la base de datos el número de fuzy 
+# sets se tendrá que calibrar. (Para 16/11/2020) el óptimo es 10.
+DEFAULT_FTS_GRID = dict(
+	fuzy_sets = [10],
+	membership_functions = [mf.gaussmf, mf.trimf],
+	orders = [2, 3],
+	models = [hofts.WeightedHighOrderFTS, pwfts.ProbabilisticWeightedFTS],
+	partitioners = [Grid.GridPartitioner]
+)
+
+# Grid ampliado, pensado para utilizarse con SuccessiveHalvingSearch. Solo 
+# incluye trimf porque pyFTS ignora la función de pertenencia, ver 
+# build_partitioner
+WIDE_FTS_GRID = dict(
+	fuzy_sets = [7, 10, 13, 16],
+	membership_functions = [mf.trimf],
+	orders = [2, 3],
+	models = [hofts.WeightedHighOrderFTS, pwfts.ProbabilisticWeightedFTS],
+	partitioners = [Grid.GridPartitioner, Entropy.EntropyPartitioner]
+)
+
+def fts_grid_candidates(grid = DEFAULT_FTS_GRID) :
+	"""Función que genera todas las combinaciones de hiperparámetros de un grid.
+	
+	Args:
+		grid (dict, opcional): diccionario con las listas de valores de cada 
+			hiperparámetro, ver DEFAULT_FTS_GRID.
+	
+	Returns:
+		(list): lista de diccionarios con los parámetros de fts_build (excepto
+			data). Las configuraciones que comparten particionador son 
+			consecutivas.
+	"""
+	candidates = []
+	for fuzy_set in grid['fuzy_sets'] :
+		for membership_function in grid['membership_functions'] :
+			for partitioner in grid['partitioners'] :
+				for order in grid['orders'] :
+					for model in grid['models'] :
+						candidates.append(dict(
+							fuzy_sets = fuzy_set,
+							membership_func = membership_function,
+							order = order,
+							model = model,
+							partitioner = partitioner
+						))
+	return candidates
+
+def evaluate_fts_candidates(data, candidates) :
+	"""Función que entrena y evalúa varias configuraciones de FTS con los 
+	mismos datos. Las configuraciones con el mismo número de conjuntos, función
+	de pertenencia y tipo de particionador comparten el particionador.
+	
+	Es una función del módulo para que pueda ejecutarse en otro proceso. No 
+	devuelve los modelos porque los modelos de pyFTS no se pueden serializar.
+	
+	Args:
+		data (:obj: `numpy.array`): Arreglo con los datos de la serie de tiempo
+			con dimensión (n,).
+		candidates (list): lista de configuraciones, ver fts_grid_candidates.
+	
+	Returns:
+		(list): lista de tuplas (error, train_prediction) de cada 
+			configuración, ver fts_train. Si una configuración no se puede 
+			entrenar con los datos (p. ej. EntropyPartitioner con pocos datos)
+			su error es infinito y su predicción es None.
+	"""
+	results = []
+	partitioners = dict()
+	for config in candidates :
+		key = (config['fuzy_sets'], config['membership_func'], config['partitioner'])
+		try :
+			if key not in partitioners :
+				partitioners[key] = build_partitioner(data, *key)
+			error, _, prediction = fts_train(data, shared_partitioner = partitioners[key], **config)
+		except Exception :
+			error, prediction = np.inf, None
+		results.append((error, prediction))
+	return results
+
+def map_fts_candidates(data, candidates, executor = None) :
+	"""Función que evalúa las configuraciones, de forma concurrente si se 
+	proporciona un executor. Las configuraciones que comparten particionador
+	se evalúan juntas.
+	
+	Args:
+		data (:obj: `numpy.array`): Arreglo con los datos de la serie de tiempo
+			con dimensión (n,).
+		candidates (list): lista de configuraciones, ver fts_grid_candidates.
+		executor (:obj: `concurrent.futures.Executor`, opcional): executor en 
+			el que se evalúan los grupos de configuraciones.
+	
+	Returns:
+		(list): lista de tuplas (error, train_prediction) en el orden de 
+			candidates.
+	"""
+	# Agrupar las configuraciones por particionador conservando el orden
+	groups = dict()
+	for i in range(len(candidates)) :
+		config = candidates[i]
+		key = (config['fuzy_sets'], config['membership_func'], config['partitioner'])
+		groups.setdefault(key, []).append(i)
+	indexes = list(groups.values())
+	batches = [[candidates[i] for i in group] for group in indexes]
+	
+	if executor is None :
+		batch_results = map(evaluate_fts_candidates, [data] * len(batches), batches)
+	else :
+		batch_results = executor.map(evaluate_fts_candidates, [data] * len(batches), batches)
+	
+	results = [None] * len(candidates)
+	for group, group_results in zip(indexes, batch_results) :
+		for i, result in zip(group, group_results) :
+			results[i] = result
+	return results
+
+class FTSSearchStrategy :
+	"""Estrategia de búsqueda de los hiperparámetros de FTS."""
+	
+	def search(self, data, candidates) :
+		"""Método que encuentra la mejor configuración de candidates para los
+		datos data.
+		
+		Returns:
+			best_index (int): índice de la mejor configuración en candidates.
+			best_error (float): MAPE de la mejor configuración con todos los 
+				datos.
+			best_prediction (:obj: `numpy.array`): predicción de los datos de 
+				entrenamiento de la mejor configuración, ver fts_train.
+		"""
+		pass
+
+class GridSearch(FTSSearchStrategy) :
+	"""Evalúa todas las configuraciones con todos los datos y elige la de 
+	menor MAPE. En caso de empate se elige la primera configuración.
+	
+	Args:
+		executor (:obj: `concurrent.futures.Executor`, opcional): executor en 
+			el que se evalúan las configuraciones de forma concurrente.
+	"""
+	
+	def __init__(self, executor = None) :
+		self.executor = executor
+	
+	def search(self, data, candidates) :
+		results = map_fts_candidates(data, candidates, self.executor)
+		best_index = None
+		for i in range(len(results)) :
+			if best_index is None or results[i][0] < results[best_index][0] :
+				best_index = i
+		best_error, best_prediction = results[best_index]
+		return best_index, best_error, best_prediction
+
+class SuccessiveHalvingSearch(FTSSearchStrategy) :
+	"""Successive halving: evalúa todas las configuraciones con un prefijo
+	corto de la serie de tiempo y en cada ronda conserva la fracción 1 / eta 
+	de las configuraciones con menor MAPE, mientras el prefijo crece 
+	geométricamente hasta llegar a la serie completa. Las configuraciones 
+	restantes se evalúan con todos los datos.
+	
+	Referencia:
+	https://arxiv.org/abs/1502.07943
+	
+	Args:
+		eta (int, opcional): factor de reducción de las configuraciones y de
+			crecimiento de los prefijos en cada ronda.
+		min_length (int, opcional): longitud mínima de los prefijos, debe ser 
+			mayor a 5 (ver fts_train).
+		executor (:obj: `concurrent.futures.Executor`, opcional): executor en 
+			el que se evalúan las configuraciones de forma concurrente.
+	"""
+	
+	def __init__(self, eta = 2, min_length = 8, executor = None) :
+		assert(eta >= 2 and min_length > 5)
+		self.eta = eta
+		self.min_length = min_length
+		self.executor = executor
+	
+	def search(self, data, candidates) :
+		survivors = list(range(len(candidates)))
+		
+		# Número de rondas hasta que quede una configuración
+		rounds = 0
+		while self.eta ** rounds < len(candidates) :
+			rounds += 1
+		
+		for i in range(rounds, 0, -1) :
+			if len(survivors) == 1 :
+				break
+			length = max(self.min_length, len(data) // self.eta ** i)
+			if length >= len(data) :
+				break
+			results = map_fts_candidates(
+				data[: length],
+				[candidates[j] for j in survivors],
+				self.executor
+			)
+			# Ordenamiento estable, en caso de empate se conserva el orden 
+			keep = max(1, len(survivors) // self.eta)
+			ranking = sorted(
+				range(len(survivors)),
+				key = lambda j : results[j][0] if not np.isnan(results[j][0]) else np.inf
+			)
+			survivors = [survivors[j] for j in sorted(ranking[: keep])]
+		
+		# Evaluar las configuraciones restantes con todos los datos
+		best_index, best_error, best_prediction = GridSearch(self.executor).search(
+			data,
+			[candidates[j] for j in survivors]
+		)
+		return survivors[best_index], best_error, best_prediction
+
+def grid_search_fts(data, strategy = None, grid = DEFAULT_FTS_GRID) :
+	"""Función que busca los hiperparámetros del modelo FTS que minimizan el 
+	MAPE de la predicción de los datos de entrenamiento.
+	
+	Args:
+	    data (:obj: `numpy.array`): Arreglo con los datos de la serie de tiempo
+	        con dimensión (n,).
+		strategy (:obj: `FTSSearchStrategy`, opcional): estrategia de búsqueda.
+			Por defecto se utiliza GridSearch sin executor.
+		grid (dict, opcional): hiperparámetros a considerar, ver 
+			DEFAULT_FTS_GRID y WIDE_FTS_GRID.
+	
+	Returns:
+		best_model (:obj: `pyFTS.models.*`): mejor modelo FTS encontrado.
+		best_config (dict): diccionario con los parámetros de fts_build 
+			(excepto data) del mejor modelo.
+		best_prediction (:obj: `numpy.array`): predicción de los datos de 
+			entrenamiento del mejor modelo con dimensiones (n - 5,), ver 
+			fts_train.
+		best_error (float): MAPE de best_prediction.
+	"""
+	if strategy is None :
+		strategy = GridSearch()
+	
+	candidates = fts_grid_candidates(grid)
+	best_index, best_error, best_prediction = strategy.search(data, candidates)
+	best_config = candidates[best_index]
+	
+	# Los modelos no se devuelven desde la búsqueda, ver evaluate_fts_candidates
+	best_model = fts_build(data, **best_config)
+	
+	return best_model, best_config, best_prediction, best_error
 
 def train_hyperopt_fts(data) :
 	"""Función que entrena un nuevo modelo de FTS dados los datos históricos
 	de una serie de tiempo. Aplica optimización de hiperparámetros utilizando
-	Grid Search.
+	Grid Search, ver grid_search_fts.
 	
 	Args:
 	    data (:obj: `numpy.array`): Arreglo con los datos de la serie de tiempo
@@ -71,37 +388,7 @@ def train_hyperopt_fts(data) :
 		best_model (:obj: `pyFTS.models.*`): mejor modelo FTS encontrado luego
 			de aplicar Grid Search Optimization.
 	"""
-	# Hiperparámetros
-	# TODO: conforme se agreguen más datos a la base de datos el número de fuzy 
-	# sets se tendrá que calibrar. (Para 16/11/2020) el óptimo es 10.
-	fuzy_sets = [10]
-	membership_functions = [mf.gaussmf, mf.trimf]
-	orders = [2, 3]
-	models = [hofts.WeightedHighOrderFTS, pwfts.ProbabilisticWeightedFTS]
-	# TODO: Intentar Entropy.EntropyPartitioner como particionador
-	partitioners = [Grid.GridPartitioner] 
-	
-	best_error = None
-	best_model = None
-	
-	# Grid search
-	for fuzy_set in fuzy_sets :
-		for membership_function in membership_functions :
-			for order in orders :
-				for model in models :
-					for partitioner in partitioners :
-						error, model = fts_train(
-							data, 
-							fuzy_set, 
-							membership_function, 
-							order, 
-							model, 
-							partitioner
-						)
-						if best_error is None or error < best_error :
-							best_error = error
-							best_model = model
-	
+	best_model, _, _, _ = grid_search_fts(data)
 	return best_model
 
 def hyperopt_fts_predict(data, prediction_size, normalizators = []) :
@@ -142,7 +429,8 @@ def hyperopt_fts_predict(data, prediction_size, normalizators = []) :
 	
 	return prediction
 
-def evaluate_and_predict_fts(data, prediction_size = 5, normalizators = [MinMaxNormalizator]) :
+def evaluate_and_predict_fts(data, prediction_size = 5, normalizators = [MinMaxNormalizator], 
+	artifact = None, train = True, strategy = None, grid = DEFAULT_FTS_GRID) :
 	"""Función que devuelve la predicción de los datos históricos y los datos
 	futuros aplicando FTS.
 	
@@ -154,6 +442,16 @@ def evaluate_and_predict_fts(data, prediction_size = 5, normalizators = [MinMaxN
 			Las normalizaciones se aplican en el orden en el que se encuentran 
 			en la lista, las clases Normalizator se encuentran en el directorio 
 			Metodos/Normalizators.
+		artifact (dict, opcional): diccionario en el que se guardan los 
+			hiperparámetros del mejor modelo del Grid Search con la llave 
+			'config'. Ver Metodos/ArtifactStore.
+		train (bool, opcional): si es False y artifact contiene hiperparámetros, 
+			se ajusta únicamente el modelo con esos hiperparámetros sin realizar
+			el Grid Search.
+		strategy (:obj: `FTSSearchStrategy`, opcional): estrategia de búsqueda
+			de los hiperparámetros, ver grid_search_fts.
+		grid (dict, opcional): hiperparámetros a considerar en la búsqueda, ver
+			DEFAULT_FTS_GRID y WIDE_FTS_GRID.
 	
 	Returns:
 		prediction (:obj: `numpy.array`): arreglo con la predicción futura con
@@ -169,20 +467,22 @@ def evaluate_and_predict_fts(data, prediction_size = 5, normalizators = [MinMaxN
 		data = normalizator.normalize(data)
 		norms.append(normalizator)
 	
-	# Entrenar el modelo
-	model = train_hyperopt_fts(data)
+	if not train and artifact is not None and 'config' in artifact :
+		# Ajustar el modelo con los hiperparámetros guardados
+		model = fts_build(data, **artifact['config'])
+		
+		# Obtener la predicción del conjunto de los datos de entrenamiento
+		train_prediction = fts_rolling_predict(model, data)
+	else :
+		# Entrenar el modelo, el Grid Search ya calcula la predicción del 
+		# conjunto de los datos de entrenamiento
+		model, config, train_prediction, _ = grid_search_fts(data, strategy, grid)
+		if artifact is not None :
+			artifact['config'] = config
 	
 	# Obtener predicción futura
 	prediction = np.array(model.predict(data, steps_ahead = prediction_size))
 	
-	# Obtener la predicción del conjunto de los datos de entrenamiento
-	train_prediction = []
-	for i in range(5, len(data)) :
-		next = model.predict(data[:i], steps_ahead = 1)
-		train_prediction.append(next[0])
-	
-	train_prediction = np.array(train_prediction)
-	
 	# Aplicar las desnormalizaciones en el orden inverso
 	for i in range(len(norms) - 1, -1, -1) :
 		train_prediction = norms[i].denormalize(train_prediction)
@@ -0,0 +1,208 @@
+# Manejo de módulos
+import os, sys
+currentdir = os.path.dirname(os.path.realpath(__file__))
+parentdir = os.path.dirname(currentdir)
+sys.path.append(parentdir)
+
+import numpy as np
+
+from Metodos.Metrics import pack_ragged
+
+def global_ar_inputs(lags) :
+	"""Función que construye las entradas del modelo autorregresivo global a
+	partir de ventanas de datos reales. Cada ventana se normaliza con su nivel
+	(el promedio de sus valores absolutos), de modo que las ventanas de
+	escuelas de distinto tamaño son comparables:
+
+	x_i' = x_i / nivel - 1
+
+	A los rezagos normalizados se agrega el logaritmo del nivel, que distingue
+	escuelas grandes y pequeñas, y el intercepto.
+
+	A diferencia de MinMaxNormalizator, el nivel solo depende de los datos de la
+	ventana. Normalizar con el mínimo y máximo de toda la serie le da al modelo
+	información de los años siguientes a cada ventana de entrenamiento, y el
+	modelo aprende a regresar al centro del rango de la serie.
+
+	Args:
+		lags (:obj: `numpy.array`): matriz de ventanas de datos reales con
+			dimensiones (k, window_len).
+
+	Returns:
+		inputs (:obj: `numpy.array`): matriz con dimensiones (k, window_len + 2).
+		level (:obj: `numpy.array`): arreglo con el nivel de cada ventana con
+			dimensiones (k,).
+	"""
+	level = np.abs(lags).mean(axis = 1)
+	scale = np.where(level > 0, level, 1)
+	inputs = np.hstack([
+		lags / scale[:, np.newaxis] - 1,
+		np.log1p(level)[:, np.newaxis],
+		np.ones((len(lags), 1))
+	])
+	return inputs, level
+
+def ridge_regression(X, y, alpha) :
+	"""Función que ajusta una regresión ridge con su solución cerrada
+	w = (X'X + alpha * I)^(-1) X'y. La última columna de X es el intercepto y
+	no se penaliza.
+
+	Args:
+		X (:obj: `numpy.array`): matriz de entradas con dimensiones (k, f).
+		y (:obj: `numpy.array`): arreglo de salidas con dimensiones (k,).
+		alpha (float): peso de la penalización.
+
+	Returns:
+		(:obj: `numpy.array`): arreglo con los pesos con dimensiones (f,).
+	"""
+	penalty = alpha * np.eye(X.shape[1])
+	penalty[-1, -1] = 0
+	return np.linalg.solve(X.T @ X + penalty, X.T @ y)
+
+def train_global_ar(data, window_len = 5, alpha = 1.0) :
+	"""Función que entrena un único modelo autorregresivo para todas las
+	series de tiempo. Cada serie se divide en ventanas de window_len años cuyo
+	siguiente año es la salida, las ventanas de todas las series se juntan y
+	se ajusta una regresión ridge sobre sus entradas, ver global_ar_inputs.
+
+	Args:
+		data (list): lista de numpy arrays de una dimensión, cada uno con los
+			valores reales de una serie de tiempo, por ejemplo la matrícula de
+			todas las escuelas de Datasets/TodasLasEscuelas.csv.
+		window_len (int, opcional): número de años anteriores que se utilizan
+			para predecir el siguiente.
+		alpha (float, opcional): peso de la penalización de la regresión ridge.
+
+	Returns:
+		(dict): modelo con los pesos de la regresión con la llave 'weights' y
+			window_len con la llave 'window_len'.
+	"""
+	matrix, mask = pack_ragged([np.asarray(serie, dtype = np.float64) for serie in data])
+
+	# Posiciones de las salidas de las ventanas de todas las series
+	targets = mask.copy()
+	targets[:, : window_len] = False
+	rows, ends = np.nonzero(targets)
+	lags = matrix[rows[:, np.newaxis], ends[:, np.newaxis] - window_len + np.arange(window_len)]
+
+	inputs, level = global_ar_inputs(lags)
+	outputs = matrix[rows, ends] / np.where(level > 0, level, 1) - 1
+	return {
+		'window_len' : window_len,
+		'weights' : ridge_regression(inputs, outputs, alpha)
+	}
+
+def global_ar_step(model, lags) :
+	"""Función que predice el año siguiente a cada ventana de datos reales.
+
+	Args:
+		model (dict): modelo devuelto por train_global_ar.
+		lags (:obj: `numpy.array`): matriz de ventanas con dimensiones
+			(k, window_len).
+
+	Returns:
+		(:obj: `numpy.array`): arreglo con la predicción con dimensiones (k,).
+	"""
+	inputs, level = global_ar_inputs(lags)
+	return (inputs @ model['weights'] + 1) * level
+
+def global_ar_forecast(model, data, prediction_size = 5) :
+	"""Función que realiza la predicción de todas las series de tiempo con el
+	modelo autorregresivo global en una sola operación por año. Cada año se
+	predice con los últimos window_len años, incluyendo las predicciones de
+	los años anteriores. Si una serie tiene menos de window_len años, los
+	rezagos faltantes se rellenan con su primer valor.
+
+	Args:
+		model (dict): modelo devuelto por train_global_ar.
+		data (list): lista de numpy arrays de una dimensión, cada uno con los
+			valores reales de una serie de tiempo.
+		prediction_size (int, opcional): número de años a predecir.
+
+	Returns:
+		prediction (:obj: `numpy.array`): matriz con la predicción futura con
+			dimensiones (m, prediction_size).
+		train_prediction (:obj: `numpy.array`): matriz con la predicción
+			histórica de un año hacia adelante con dimensiones (m, n), válida
+			de la posición window_len a la longitud de cada serie.
+	"""
+	window_len = model['window_len']
+	matrix, mask = pack_ragged([np.asarray(serie, dtype = np.float64) for serie in data])
+	lengths = mask.sum(axis = 1)
+	m, n = matrix.shape
+
+	# Predicción futura, se parte de los últimos window_len años de cada serie
+	positions = np.maximum(lengths[:, np.newaxis] - window_len + np.arange(window_len), 0)
+	history = np.zeros((m, window_len + prediction_size))
+	history[:, : window_len] = matrix[np.arange(m)[:, np.newaxis], positions]
+	for i in range(prediction_size) :
+		history[:, window_len + i] = global_ar_step(model, history[:, i : i + window_len])
+
+	# Predicción histórica de un año hacia adelante
+	train_prediction = np.zeros((m, n))
+	if n > window_len :
+		positions = np.arange(window_len, n)[:, np.newaxis] - window_len + np.arange(window_len)
+		lags = matrix[:, positions].reshape(-1, window_len)
+		train_prediction[:, window_len :] = global_ar_step(model, lags).reshape(m, n - window_len)
+
+	return history[:, window_len :], train_prediction
+
+def global_ar_predict(data, prediction_size, window_len = 5, alpha = 1.0, model = None) :
+	"""Realiza la predicción de un lote de series de tiempo con el modelo
+	autorregresivo global. Es la función por lotes que utiliza la clase Model
+	de JupyterNotebooks/Evaluation.py con batch = True.
+
+	Args:
+		data (list): lista de numpy arrays de una dimensión, cada uno con los
+			valores reales de una serie de tiempo.
+		prediction_size (int): número de años a predecir.
+		window_len (int, opcional): ver train_global_ar.
+		alpha (float, opcional): ver train_global_ar.
+		model (dict, opcional): modelo entrenado con train_global_ar. Si no se
+			proporciona se entrena con las propias series de data.
+
+	Returns:
+		(:obj: `numpy.array`): matriz con la predicción de cada serie con
+			dimensiones (m, prediction_size).
+	"""
+	if model is None :
+		model = train_global_ar(data, window_len, alpha)
+	return global_ar_forecast(model, data, prediction_size)[0]
+
+def evaluate_and_predict_global_ar_batch(data, prediction_size = 5, window_len = 5, alpha = 1.0, model = None) :
+	"""Función que devuelve la predicción de los datos históricos y los datos
+	futuros de varias series de tiempo con el modelo autorregresivo global.
+
+	Args:
+		data (list): lista de numpy arrays de una dimensión, cada uno con los
+			valores reales de una serie de tiempo.
+		prediction_size (int, opcional): número de años a predecir.
+		window_len (int, opcional): ver train_global_ar.
+		alpha (float, opcional): ver train_global_ar.
+		model (dict, opcional): modelo entrenado con train_global_ar. Si no se
+			proporciona se entrena con las propias series de data.
+
+	Returns:
+		(list): lista de tuplas (prediction, train_prediction) en el mismo orden
+			que data, con dimensiones (prediction_size,) y (n - window_len,)
+			respectivamente, donde n es la longitud de cada serie.
+	"""
+	if model is None :
+		model = train_global_ar(data, window_len, alpha)
+	prediction, train_prediction = global_ar_forecast(model, data, prediction_size)
+	return [
+		(prediction[i], train_prediction[i, model['window_len'] : len(data[i])])
+		for i in range(len(data))
+	]
+
+if __name__ == '__main__' :
+	import pandas as pd
+
+	# Entrenar con la matrícula de todas las escuelas sin los últimos 5 años
+	dataset = pd.read_csv(os.path.join(parentdir, 'Datasets', 'TodasLasEscuelas.csv'))
+	series = list(dataset.iloc[:, 1 :].to_numpy(dtype = np.float64))
+	model = train_global_ar([serie[: -5] for serie in series])
+
+	escuela = np.array([89,127,134,152,170,172,182,192,197,210,219,222,233,226,222,205,222])
+	prediccion = global_ar_predict([escuela], prediction_size = 5, model = model)
+	print(prediccion[0])
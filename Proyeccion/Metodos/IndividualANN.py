@@ -4,10 +4,15 @@ currentdir = os.path.dirname(os.path.realpath(__file__))
 parentdir = os.path.dirname(currentdir)
 sys.path.append(parentdir)
 
-import tensorflow as tf
 import numpy as np
 
 from Metodos.Normalizators import MinMaxNormalizator
+from Metodos.Metrics import pack_ragged
+
+# Arquitectura de la red neuronal autoregresiva: número de neuronas y función
+# de activación de cada capa densa
+LAYER_UNITS = [60, 30, 15, 1]
+LAYER_ACTIVATIONS = ["tanh", "tanh", None, None]
 
 def get_batch_size(n) :
 	"""Función que encuentra un divisor de n para ser el tamaño del batch. Se
@@ -57,6 +62,8 @@ def load_data(data, window_len, shuffle = False) :
 			primer dimensión corresponde al número de batches, la segunda
 			corresponde al tamaño de cada batch.
 	"""
+	import tensorflow as tf
+	
 	input_data = data[: -1]
 	targets = np.concatenate((data[window_len :], np.zeros(window_len - 1)), axis = 0)
 	
@@ -81,6 +88,101 @@ def load_data(data, window_len, shuffle = False) :
 	
 	return tf.cast(inputs, tf.float64), tf.cast(targets, tf.float64)
 
+def build_individual_ann(window_len) :
+	"""Función que construye la arquitectura de la red neuronal autoregresiva
+	sin entrenar.
+	
+	Args:
+		window_len (int): número de lags que representan a los predictores de la
+			ANN.
+	
+	Returns:
+		model (:obj: `tensorflow.python.keras.engine.sequential.Sequential`):
+			modelo con la arquitectura de la red neuronal autoregresiva.
+	"""
+	import tensorflow as tf
+	
+	layers = [
+		tf.keras.layers.Dense(units, activation = activation)
+		for units, activation in zip(LAYER_UNITS, LAYER_ACTIVATIONS)
+	]
+	return tf.keras.models.Sequential([tf.keras.Input(shape = (None, window_len))] + layers)
+
+def export_nar_weights(model) :
+	"""Función que exporta los pesos de una red neuronal entrenada a arreglos
+	de numpy, de modo que la predicción pueda realizarse sin TensorFlow, ver
+	nar_predict.
+	
+	Args:
+		model (:obj: `tensorflow.python.keras.engine.sequential.Sequential`):
+			modelo que contiene a la red neuronal autoregresiva entrenada.
+	
+	Returns:
+		(list): lista de numpy arrays en float32 con el kernel y el bias de 
+			cada capa, en el orden de LAYER_UNITS.
+	"""
+	return [np.asarray(weight, dtype = np.float32) for weight in model.get_weights()]
+
+def nar_forward(weights, inputs) :
+	"""Función que calcula la salida de la red neuronal autoregresiva a partir
+	de sus pesos utilizando únicamente numpy.
+	
+	Args:
+		weights (list): pesos de la red neuronal, ver export_nar_weights.
+		inputs (:obj: `numpy.array`): arreglo con dimensiones (k, window_len)
+			con k ventanas de predictores.
+	
+	Returns:
+		(:obj: `numpy.array`): arreglo con dimensiones (k, 1) con la 
+			predicción de cada ventana.
+	"""
+	outputs = inputs
+	for i in range(len(LAYER_UNITS)) :
+		outputs = outputs @ weights[2 * i] + weights[2 * i + 1]
+		if LAYER_ACTIVATIONS[i] == "tanh" :
+			outputs = np.tanh(outputs)
+	return outputs
+
+def nar_predict(weights, data, window_len, prediction_size) :
+	"""Función que calcula la predicción futura y la predicción histórica de
+	la red neuronal autoregresiva a partir de sus pesos. Los cálculos se 
+	realizan en float32, igual que en Keras.
+	
+	La predicción futura se obtiene recursivamente: la predicción de cada año
+	se agrega a la ventana de predictores para predecir el siguiente año.
+	
+	Args:
+		weights (list): pesos de la red neuronal, ver export_nar_weights.
+		data (:obj: `numpy.array`): numpy array con los valores normalizados
+			de la serie de tiempo con dimensiones (n,).
+		window_len (int): número de lags que representan a los predictores de la
+			ANN.
+		prediction_size (int): número de años a predecir.
+	
+	Returns:
+		prediction (:obj: `numpy.array`): arreglo con la predicción futura con
+			dimensiones (prediction_size,).
+		train_prediction (:obj: `numpy.array`): arreglo con la predicción de
+			cada ventana de los datos de entrenamiento (ver load_data) con 
+			dimensiones (n - window_len,).
+	"""
+	data = np.asarray(data, dtype = np.float32)
+	
+	# Ventanas de window_len observaciones consecutivas, la última ventana
+	# contiene los predictores del primer año a predecir
+	starts = np.arange(len(data) - window_len + 1)
+	windows = data[starts[:, np.newaxis] + np.arange(window_len)]
+	train_prediction = nar_forward(weights, windows[: -1])[:, 0]
+	
+	window = windows[-1].copy()
+	prediction = np.zeros(prediction_size, dtype = np.float32)
+	for i in range(prediction_size) :
+		prediction[i] = nar_forward(weights, window[np.newaxis, :])[0, 0]
+		window[: -1] = window[1 :]
+		window[-1] = prediction[i]
+	
+	return prediction.astype(np.float64), train_prediction.astype(np.float64)
+
 def train_individual_ann(data, window_len) :
 	"""Función que entrena una nueva red neuronal dados los datos de una serie
 	de tiempo y el número de lags que se consideran predictores.
@@ -105,18 +207,15 @@ def train_individual_ann(data, window_len) :
 		model (:obj: `tensorflow.python.keras.engine.sequential.Sequential`):
 			modelo que contiene a la red neuronal autoregresiva entrenada.
 	"""
+	import tensorflow as tf
+	
 	tf.random.set_seed(1)
 	
 	# Cargar los datos de entrenamiento como batches para la red neuronal
 	inputs, targets = load_data(data, window_len)
 	
 	# Definir arquitectura de la red neuronal
-	model = tf.keras.models.Sequential([
-		tf.keras.layers.Dense(60, input_shape = (None, inputs.shape[2]), activation = "tanh"),
-		tf.keras.layers.Dense(30, activation = "tanh"),
-		tf.keras.layers.Dense(15, ),
-		tf.keras.layers.Dense(1)
-	])
+	model = build_individual_ann(inputs.shape[2])
 	
 	# Asignar el optimizador y la función de costo
 	model.compile(
@@ -147,6 +246,180 @@ def train_individual_ann(data, window_len) :
 	
 	return model
 
+def train_individual_ann_batch(data, window_len, epochs = 100, patience = 5) :
+	"""Función que entrena una red neuronal autoregresiva independiente para
+	cada serie de tiempo de un lote, todas en el mismo ciclo de épocas. Los
+	pesos de las K redes se apilan en un eje inicial y cada capa se calcula con
+	un producto de matrices por lotes, de modo que TensorFlow procesa todas las
+	escuelas en cada operación.
+	
+	El entrenamiento de cada red es el mismo que el de train_individual_ann:
+	- Todas las redes parten de los pesos de build_individual_ann generados 
+	  con la semilla 1, los mismos con los que parte train_individual_ann.
+	- Cada época es un solo paso de SGD con momentum sobre todas las ventanas
+	  de la serie con el error cuadrático medio. model.fit de
+	  train_individual_ann recibe los batches de load_data como muestras y, con
+	  el tamaño de batch de Keras (32), todos entran en un solo paso en las
+	  series de menos de 32 ventanas, como las de matrícula.
+	- La tasa de aprendizaje crece en cada época como en el LearningRateScheduler.
+	- Cada red se detiene con la regla de EarlyStopping(monitor = 'loss') con
+	  su propio error, las redes detenidas dejan de actualizarse.
+	
+	Por lo tanto cada red se entrena igual que con train_individual_ann. Las
+	predicciones solo difieren por el error de redondeo del punto flotante,
+	porque las operaciones por lotes suman en otro orden.
+	
+	Args:
+		data (list): lista de numpy arrays de una dimensión, cada uno con los
+			valores normalizados de una serie de tiempo con más de window_len
+			valores.
+		window_len (int): número de lags que representan a los predictores de la
+			ANN.
+		epochs (int, opcional): número máximo de épocas.
+		patience (int, opcional): número de épocas sin mejorar el error
+			después de las cuales se detiene una red.
+	
+	Returns:
+		weights (list): lista con los pesos de la red de cada serie en el mismo
+			orden que data, ver export_nar_weights.
+		trained_epochs (:obj: `numpy.array`): arreglo con el número de épocas
+			que se entrenó cada red con dimensiones (K,).
+	"""
+	import tensorflow as tf
+	
+	matrix, mask = pack_ragged([np.asarray(serie, dtype = np.float32) for serie in data])
+	K, n = matrix.shape
+	
+	# Ventanas de entrenamiento de todas las series, las ventanas cuyo target
+	# es una posición de relleno no se consideran en el error
+	starts = np.arange(n - window_len)
+	inputs = matrix[:, starts[:, np.newaxis] + np.arange(window_len)]
+	targets = matrix[:, starts + window_len]
+	valid = mask[:, starts + window_len].astype(np.float32)
+	count = valid.sum(axis = 1)
+	
+	# Pesos iniciales de train_individual_ann repetidos para cada red
+	tf.random.set_seed(1)
+	weights = [
+		tf.Variable(np.repeat(weight[np.newaxis], K, axis = 0).astype(np.float32))
+		for weight in build_individual_ann(window_len).get_weights()
+	]
+	velocities = [tf.Variable(tf.zeros_like(weight)) for weight in weights]
+	
+	inputs = tf.constant(inputs, dtype = tf.float32)
+	targets = tf.constant(targets, dtype = tf.float32)
+	valid = tf.constant(valid, dtype = tf.float32)
+	count = tf.constant(count, dtype = tf.float32)
+	
+	@tf.function
+	def train_step(learning_rate, active) :
+		with tf.GradientTape() as tape :
+			outputs = inputs
+			for i in range(len(LAYER_UNITS)) :
+				outputs = tf.matmul(outputs, weights[2 * i]) + weights[2 * i + 1][:, tf.newaxis, :]
+				if LAYER_ACTIVATIONS[i] == "tanh" :
+					outputs = tf.tanh(outputs)
+			# Error cuadrático medio de cada red
+			losses = tf.reduce_sum(valid * tf.square(outputs[:, :, 0] - targets), axis = 1) / count
+			# Las redes son independientes, el gradiente de la suma es el
+			# gradiente de cada red
+			total = tf.reduce_sum(losses)
+		gradients = tape.gradient(total, weights)
+		
+		# SGD con momentum, solo se actualizan las redes activas
+		for weight, velocity, gradient in zip(weights, velocities, gradients) :
+			shape = [-1] + [1] * (len(weight.shape) - 1)
+			update = tf.reshape(active, shape)
+			velocity.assign(update * (0.9 * velocity - learning_rate * gradient) + (1 - update) * velocity)
+			weight.assign_add(update * velocity)
+		return losses
+	
+	# Estado de EarlyStopping de cada red
+	best = np.full(K, np.inf)
+	wait = np.zeros(K, dtype = np.int64)
+	active = np.ones(K, dtype = bool)
+	trained_epochs = np.zeros(K, dtype = np.int64)
+	
+	for epoch in range(epochs) :
+		learning_rate = 1e-6 * 10 ** (epoch / 20)
+		losses = train_step(tf.constant(learning_rate, tf.float32), tf.constant(active, tf.float32)).numpy()
+		trained_epochs[active] += 1
+		
+		wait[active] += 1
+		improved = active & (losses < best)
+		best[improved] = losses[improved]
+		wait[improved] = 0
+		if epoch > 0 :
+			active &= wait < patience
+		if not active.any() :
+			break
+	
+	weights = [weight.numpy() for weight in weights]
+	return [[weight[k] for weight in weights] for k in range(K)], trained_epochs
+
+def fine_tune_individual_ann(data, window_len, weights, learning_rate, epochs = 10) :
+	"""Función que continúa el entrenamiento de una red neuronal entrenada
+	previamente, por ejemplo cuando la serie de tiempo tiene un nuevo año. La
+	red neuronal parte de los pesos dados y se entrena unas pocas épocas con
+	una tasa de aprendizaje fija.
+	
+	Args:
+		data (:obj: `numpy.array`): numpy array con los valores reales de la
+			serie de tiempo con dimensiones (n,).
+		window_len (int): número de lags que representan a los predictores de la
+			ANN.
+		weights (list): pesos de la red neuronal entrenada previamente, ver
+			export_nar_weights.
+		learning_rate (float): tasa de aprendizaje del ajuste.
+		epochs (int, opcional): número máximo de épocas del ajuste.
+	
+	Returns:
+		model (:obj: `tensorflow.python.keras.engine.sequential.Sequential`):
+			modelo que contiene a la red neuronal ajustada o None si los pesos
+			no corresponden a la arquitectura o si el error diverge, en cuyo
+			caso la red neuronal debe entrenarse desde cero.
+	"""
+	import tensorflow as tf
+	
+	tf.random.set_seed(1)
+	
+	# Cargar los datos de entrenamiento como batches para la red neuronal
+	inputs, targets = load_data(data, window_len)
+	
+	model = build_individual_ann(inputs.shape[2])
+	try :
+		model.set_weights(weights)
+	except ValueError :
+		return None
+	
+	model.compile(
+		loss = "mse",
+		optimizer = tf.keras.optimizers.SGD(learning_rate = learning_rate, momentum = 0.9)
+	)
+	initial_loss = model.evaluate(inputs, targets, verbose = 0)
+	
+	# Asignar un callback para que termine el ajuste si deja de aprender
+	early_stopping = tf.keras.callbacks.EarlyStopping(
+		monitor='loss',
+		patience=2,
+		mode='min'
+	)
+	
+	history = model.fit(
+		inputs,
+		targets,
+		epochs = epochs,
+		callbacks = [early_stopping],
+		verbose = 0
+	)
+	
+	# Verificar que el error no haya divergido
+	final_loss = history.history['loss'][-1]
+	if not np.isfinite(final_loss) or final_loss > initial_loss :
+		return None
+	
+	return model
+
 def individual_ann_predict(data, prediction_size, window_len, normalizators = []) :
 	"""Función que entrena una red neuronal para una sola serie de tiempo y que
 	se entrena únicamente con los datos de la serie de tiempo.
@@ -177,25 +450,15 @@ def individual_ann_predict(data, prediction_size, window_len, normalizators = []
 	model = train_individual_ann(data, window_len)
 	
 	# Obtener predicción
-	prediction = np.zeros(prediction_size)
-	X = np.zeros((1, window_len))
-	X[0] = data[-window_len:]
-	assert(X.shape == (1, window_len))
-	
-	for i in range(prediction_size) :
-		X_tensor = tf.constant(X)
-		X_tensor = tf.reshape(X_tensor, (1, 1, window_len))
-		prediction[i] = model.predict(X_tensor)[0][0][0]
-		for j in range(window_len - 1) :
-			X[0][j] = X[0][j + 1]
-		X[0][window_len - 1] = prediction[i]
+	prediction, _ = nar_predict(export_nar_weights(model), data, window_len, prediction_size)
 	
 	# Aplicar las desnormalizaciones en el orden inverso
 	for i in range(len(norms) - 1, -1, -1) :
 		prediction = norms[i].denormalize(prediction)
 	return prediction
 
-def evaluate_and_predict_ann(data, prediction_size = 5, window_len = 5, normalizators = [MinMaxNormalizator]) :
+def evaluate_and_predict_ann(data, prediction_size = 5, window_len = 5, normalizators = [MinMaxNormalizator], 
+	artifact = None, train = True) :
 	"""Función que devuelve la predicción de los datos históricos y los datos
 	futuros aplicando redes neuronales.
 	
@@ -209,6 +472,17 @@ def evaluate_and_predict_ann(data, prediction_size = 5, window_len = 5, normaliz
 			Las normalizaciones se aplican en el orden en el que se encuentran 
 			en la lista, las clases Normalizator se encuentran en el directorio 
 			Metodos/Normalizators.
+		artifact (dict, opcional): diccionario en el que se guardan los pesos de
+			la red neuronal entrenada con la llave 'weights' y la tasa de 
+			aprendizaje de la última época con la llave 'learning_rate'. Ver 
+			Metodos/ArtifactStore.
+		train (bool, opcional): si es False y artifact contiene los pesos de una
+			red neuronal, la predicción se realiza con esos pesos sin entrenar
+			y sin importar TensorFlow.
+			Si es True y artifact contiene los pesos y la tasa de aprendizaje,
+			la red neuronal se ajusta a partir de ellos y solo se entrena desde
+			cero si el ajuste diverge, ver fine_tune_individual_ann. Para 
+			entrenar desde cero se debe proporcionar un artifact vacío.
 	
 	Returns:
 		prediction (:obj: `numpy.array`): arreglo con la predicción futura con
@@ -225,27 +499,37 @@ def evaluate_and_predict_ann(data, prediction_size = 5, window_len = 5, normaliz
 		data = normalizator.normalize(data)
 		norms.append(normalizator)
 
-	# Entrenar el modelo
-	model = train_individual_ann(data, window_len)
+	if not train and artifact is not None and 'weights' in artifact :
+		# Utilizar los pesos guardados, no hace falta importar TensorFlow
+		weights = artifact['weights']
+	else :
+		model = None
+		if artifact is not None and 'weights' in artifact and artifact.get('learning_rate') is not None :
+			# Ajustar el modelo previo. Los artefactos de versiones anteriores
+			# no guardan la tasa de aprendizaje y se entrenan desde cero
+			model = fine_tune_individual_ann(
+				data,
+				window_len,
+				artifact['weights'],
+				artifact['learning_rate']
+			)
+		
+		if model is None :
+			# Entrenar el modelo
+			model = train_individual_ann(data, window_len)
+			if artifact is not None :
+				# Tasa de aprendizaje de la última época, ver train_individual_ann
+				epochs = len(model.history.history['loss'])
+				artifact['learning_rate'] = 1e-6 * 10 ** ((epochs - 1) / 20)
+		
+		weights = export_nar_weights(model)
+		if artifact is not None :
+			artifact['weights'] = weights
 	
-	# Obtener predicción futura
-	prediction = np.zeros(prediction_size)
-	X = np.zeros((1, window_len))
-	X[0] = data[-window_len:]
-	assert(X.shape == (1, window_len))
+	# Obtener la predicción futura y la del conjunto de los datos de 
+	# entrenamiento
+	prediction, train_prediction = nar_predict(weights, data, window_len, prediction_size)
 	
-	for i in range(prediction_size) :
-		X_tensor = tf.constant(X)
-		X_tensor = tf.reshape(X_tensor, (1, 1, window_len))
-		prediction[i] = model.predict(X_tensor)[0][0][0]
-		for j in range(window_len - 1) :
-			X[0][j] = X[0][j + 1]
-		X[0][window_len - 1] = prediction[i]
-	
-	# Obtener la predicción del conjunto de los datos de entrenamiento
-	inputs, targets = load_data(data, window_len)
-	train_prediction = model.predict(inputs).flatten()
-		
 	# Aplicar las desnormalizaciones en el orden inverso
 	for i in range(len(norms) - 1, -1, -1) :
 		train_prediction = norms[i].denormalize(train_prediction)
@@ -253,6 +537,60 @@ def evaluate_and_predict_ann(data, prediction_size = 5, window_len = 5, normaliz
 	
 	return prediction, train_prediction
 
+def evaluate_and_predict_ann_batch(data, prediction_size = 5, window_len = 5, normalizators = [MinMaxNormalizator],
+	artifacts = None) :
+	"""Función que devuelve la predicción de los datos históricos y los datos
+	futuros de varias series de tiempo aplicando redes neuronales. Las redes de
+	todas las series se entrenan juntas desde cero, ver 
+	train_individual_ann_batch.
+	
+	Args:
+		data (list): lista de numpy arrays de una dimensión, cada uno con los
+			valores reales de una serie de tiempo con más de window_len valores.
+		prediction_size (int, opcional): número de años a predecir.
+		window_len (int, opcional): número de observaciones que se consideran 
+			predictores.
+		normalizators (:list: `Normalizator`, opcional): ver
+			evaluate_and_predict_ann.
+		artifacts (list, opcional): lista de diccionarios en el mismo orden que
+			data en los que se guardan los pesos y la tasa de aprendizaje de
+			cada red, ver evaluate_and_predict_ann.
+	
+	Returns:
+		(list): lista de tuplas (prediction, train_prediction) en el mismo orden
+			que data, ver evaluate_and_predict_ann.
+	"""
+	# Aplicar las normalizaciones a cada serie
+	series = []
+	norms = []
+	for serie in data :
+		serie = np.asarray(serie, dtype = np.float64)
+		serie_norms = []
+		for normalizator_class in normalizators :
+			normalizator = normalizator_class(serie)
+			serie = normalizator.normalize(serie)
+			serie_norms.append(normalizator)
+		series.append(serie)
+		norms.append(serie_norms)
+	
+	weights, trained_epochs = train_individual_ann_batch(series, window_len)
+	
+	results = []
+	for k, (serie, serie_weights, serie_norms) in enumerate(zip(series, weights, norms)) :
+		if artifacts is not None :
+			# Tasa de aprendizaje de la última época, ver train_individual_ann
+			artifacts[k]['weights'] = serie_weights
+			artifacts[k]['learning_rate'] = 1e-6 * 10 ** ((trained_epochs[k] - 1) / 20)
+		
+		prediction, train_prediction = nar_predict(serie_weights, serie, window_len, prediction_size)
+		
+		# Aplicar las desnormalizaciones en el orden inverso
+		for i in range(len(serie_norms) - 1, -1, -1) :
+			train_prediction = serie_norms[i].denormalize(train_prediction)
+			prediction = serie_norms[i].denormalize(prediction)
+		results.append((prediction, train_prediction))
+	return results
+
 if __name__ == '__main__' :
 	escuela = np.array([89,127,134,152,170,172,182,192,197,210,219,222,233,226,222,205,222])
 	prediccion = individual_ann_predict(
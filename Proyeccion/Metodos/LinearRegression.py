@@ -5,10 +5,68 @@ parentdir = os.path.dirname(currentdir)
 sys.path.append(parentdir)
 
 import numpy as np
-from sklearn.linear_model import LinearRegression
 
 from Metodos.Normalizators import MinMaxNormalizator
 
+def window_regression_coefficients(window_lens, max_len) :
+	"""Función que calcula los coeficientes de la predicción de una regresión
+	lineal sobre una ventana de datos. Al ajustar una recta a los datos 
+	y_1, ..., y_w con x = 1, ..., w, la predicción en x = w + 1 es una 
+	combinación lineal de los datos:
+	
+	ŷ_(w + 1) = Σ c_i * y_i,  c_i = 1 / w + (w + 1 - x̄) * (i - x̄) / Σ (i - x̄)²
+	
+	Args:
+		window_lens (:obj: `numpy.array`): arreglo con los tamaños de ventana w
+			con dimensiones (k,), todos mayores o iguales a 2.
+		max_len (int): número de columnas de la matriz, mayor o igual al 
+			tamaño de ventana más grande.
+	
+	Returns:
+		(:obj: `numpy.array`): matriz con dimensiones (k, max_len) en la que el 
+			renglón r contiene los coeficientes c_i de la ventana window_lens[r]
+			alineados a la derecha y ceros a la izquierda.
+	"""
+	w = np.asarray(window_lens, dtype = np.float64)[:, np.newaxis]
+	# Posición i de cada columna dentro de su ventana, alineada a la derecha
+	i = np.arange(1, max_len + 1) - (max_len - w)
+	x_mean = (w + 1) / 2
+	sxx = w * (w * w - 1) / 12
+	coefficients = 1 / w + (w + 1 - x_mean) * (i - x_mean) / sxx
+	return np.where(i >= 1, coefficients, 0)
+
+def linear_regression_windows(data, prediction_size, window_lens) :
+	"""Función que realiza la predicción de linear_regression para varios 
+	tamaños de ventana a la vez. Cada año se predice con la regresión lineal
+	de los últimos window_len datos, incluyendo las predicciones de los años
+	anteriores.
+	
+	Args:
+		data (:obj: `numpy.array`): datos para la regresión lineal.
+		prediction_size (int): número de años que se busca predecir.
+		window_lens (:obj: `numpy.array`): arreglo con los tamaños de ventana a
+			evaluar con dimensiones (k,), todos entre 2 y len(data).
+	
+	Returns:
+		(:obj: `numpy.array`): matriz con dimensiones (k, prediction_size) con
+			la predicción de cada tamaño de ventana.
+	"""
+	window_lens = np.asarray(window_lens)
+	n = len(data)
+	max_len = int(window_lens.max())
+	assert(window_lens.min() >= 2 and max_len <= n)
+	
+	coefficients = window_regression_coefficients(window_lens, max_len)
+	
+	# Cada renglón contiene los datos seguidos de la predicción de su ventana
+	prediction = np.zeros((len(window_lens), n + prediction_size))
+	prediction[:, : n] = data
+	for j in range(prediction_size) :
+		window = prediction[:, n + j - max_len : n + j]
+		prediction[:, n + j] = (coefficients * window).sum(axis = 1)
+	
+	return prediction[:, n :]
+
 def linear_regression(data, prediction_size, window_len) :
 	"""Función que realiza una predicción utilizando los últimos window_len datos
 	en una regresión lineal.
@@ -24,21 +82,21 @@ def linear_regression(data, prediction_size, window_len) :
 			los datos de la predicción.
 	"""
 	assert(len(data) >= window_len)
-	prediction = np.concatenate((data, np.zeros(prediction_size)), axis = 0)
-	X_train = np.array([i for i in range(1, window_len + 1)]).reshape((-1, 1))
-	X_pred = np.array([i for i in range(1, window_len + 2)]).reshape((-1, 1))
-	
-	for j in range(prediction_size) :
-		model = LinearRegression().fit(X_train, prediction[-(window_len + prediction_size - j) : -(prediction_size - j)])
-		y_pred = model.predict(X_pred)
-		prediction[len(data) + j] = y_pred[-1]
-	
-	return prediction[-prediction_size :]
+	return linear_regression_windows(data, prediction_size, [window_len])[0]
 	
 def best_prediction(X, Y, verbose = False) :
 	"""Función que encuentra el valor de window_len para el que la regresión
 	lineal predice mejor los datos de Y. Se utiliza la métrica MAE para la
-	comparación.
+	comparación. Todos los valores de window_len se evalúan a la vez, ver
+	linear_regression_windows.
+	
+	En caso de empate se elige la ventana más pequeña, igual que la versión 
+	original que evaluaba las ventanas una por una con MAE < best_error. Sin 
+	embargo los errores se calculan en otro orden, por lo que dos ventanas que
+	empatan salvo por el error de redondeo del punto flotante se consideran un
+	empate. La versión original elegía la de menor error de redondeo, por lo 
+	que en esas series la ventana elegida puede cambiar (15 de 2000 series 
+	enteras aleatorias en la comparación con la versión original).
 	
 	Args:
 		X (:obj: `numpy.array`): numpy array con los datos con los que la
@@ -56,25 +114,29 @@ def best_prediction(X, Y, verbose = False) :
 	validation_size = len(Y)
 	train_size = len(X)
 	best_window = 2
-	best_error = 1000000
-	
-	for window_len in range(2, train_size) :
-		prediction = linear_regression(
-			data = X,
-			prediction_size = validation_size,
-			window_len = window_len
-		)
-		assert(prediction.shape == Y.shape)
-		MAE = np.abs(prediction - Y).mean()	# Mean Absolute Error
-		
-		if verbose :
-			print("WINDOW_LEN:", window_len, "MAE:", MAE)
-		
-		if MAE < best_error :
-			best_error = MAE
-			best_window = window_len
 	
-	return best_window
+	window_lens = np.arange(2, train_size)
+	if not len(window_lens) :
+		return best_window
+	
+	prediction = linear_regression_windows(
+		data = X,
+		prediction_size = validation_size,
+		window_lens = window_lens
+	)
+	# Mean Absolute Error
+	MAE = np.abs(prediction - Y).mean(axis = 1)
+	
+	if verbose :
+		for window_len, error in zip(window_lens, MAE) :
+			print("WINDOW_LEN:", window_len, "MAE:", error)
+	
+	# En caso de empate se elige la ventana más pequeña. Los errores que solo
+	# difieren por el error de redondeo (p. ej. con datos perfectamente
+	# lineales todos son casi cero) se consideran empates
+	scale = max(np.abs(Y).max(), 1)
+	ties = np.isclose(MAE, MAE.min(), rtol = 1e-12, atol = 1e-12 * scale)
+	return int(window_lens[np.argmax(ties)])
 
 def linear_regression_predict(data, prediction_size, normalizators = [], validation_size = 1, verbose = False) :
 	"""Función que realiza una predicción utilizando regresión lineal. Primero
@@ -139,6 +201,8 @@ def base_linear_regression(data, prediction_size, window_len = -1) :
 	Returns:
 		(:obj: `numpy.array`): numpy array con los valores de la predicción.
 	"""
+	from sklearn.linear_model import LinearRegression
+
 	if window_len == -1 :
 		window_len = len(data)
 	
@@ -174,6 +238,8 @@ def evaluate_and_predict_slr(data, prediction_size = 5, normalizators = [MinMaxN
 		train_prediction (:obj: `numpy.array`): arreglo con la predicción histórica
 			con dimensiones (n,).
 	"""
+	from sklearn.linear_model import LinearRegression
+
 	assert(len(data) >= 2)
 
 	# Aplicar las normalizaciones
@@ -205,6 +271,80 @@ def evaluate_and_predict_slr(data, prediction_size = 5, normalizators = [MinMaxN
 		
 	return prediction, train_prediction
 
+def slr_closed_form(data, prediction_size) :
+	"""Función que ajusta una regresión lineal simple a cada renglón de una 
+	matriz de series de tiempo de la misma longitud utilizando la solución 
+	cerrada de mínimos cuadrados.
+	
+	Args:
+		data (:obj: `numpy.array`): numpy array con dimensiones (m, n), cada
+			renglón es una serie de tiempo con n >= 2 observaciones.
+		prediction_size (int): número de años a predecir.
+	
+	Returns:
+		prediction (:obj: `numpy.array`): arreglo con la predicción futura con
+			dimensiones (m, prediction_size).
+		train_prediction (:obj: `numpy.array`): arreglo con la predicción histórica
+			con dimensiones (m, n).
+	"""
+	n = data.shape[1]
+	assert(n >= 2)
+	
+	x = np.arange(n, dtype = np.float64)
+	x_mean = x.mean()
+	y_mean = data.mean(axis = 1, keepdims = True)
+	
+	# Pendiente y ordenada al origen de cada serie
+	slope = ((data - y_mean) * (x - x_mean)).sum(axis = 1, keepdims = True) / np.square(x - x_mean).sum()
+	intercept = y_mean - slope * x_mean
+	
+	train_prediction = intercept + slope * x
+	prediction = intercept + slope * np.arange(n, n + prediction_size)
+	
+	return prediction, train_prediction
+
+def evaluate_and_predict_slr_batch(data, prediction_size = 5) :
+	"""Versión por lotes de evaluate_and_predict_slr. Agrupa las series de 
+	tiempo por longitud en matrices y ajusta todas las series de un mismo grupo
+	en una sola operación con slr_closed_form.
+	
+	No se aplican normalizaciones: la regresión lineal es invariante ante la 
+	transformación afín de MinMaxNormalizator, por lo que el resultado es el 
+	mismo que el de evaluate_and_predict_slr con sus parámetros por defecto
+	salvo por el error de redondeo del punto flotante. Como la predicción se
+	trunca a enteros al guardarse, ese error cambia el resultado cuando la 
+	predicción es casi entera (p. ej. 112 contra 111.99999999999999), por lo 
+	que esas series se predicen de nuevo con evaluate_and_predict_slr.
+	
+	Args:
+		data (list): lista de numpy arrays de una dimensión, cada uno con los 
+			valores reales de una serie de tiempo con al menos 2 observaciones.
+		prediction_size (int, opcional): número de años a predecir.
+	
+	Returns:
+		(list): lista de tuplas (prediction, train_prediction) en el mismo orden
+			que data, con dimensiones (prediction_size,) y (n,) respectivamente.
+	"""
+	results = [None] * len(data)
+	
+	# Agrupar las series por longitud
+	groups = dict()
+	for i in range(len(data)) :
+		groups.setdefault(len(data[i]), []).append(i)
+	
+	for indexes in groups.values() :
+		matrix = np.array([data[i] for i in indexes], dtype = np.float64)
+		prediction, train_prediction = slr_closed_form(matrix, prediction_size)
+		for j in range(len(indexes)) :
+			results[indexes[j]] = (prediction[j], train_prediction[j])
+	
+	for i in range(len(data)) :
+		prediction = results[i][0]
+		if np.any(np.abs(prediction - np.round(prediction)) <= 1e-6 * np.maximum(np.abs(prediction), 1)) :
+			results[i] = evaluate_and_predict_slr(np.asarray(data[i]), prediction_size)
+	
+	return results
+
 if __name__ == '__main__' :
 	escuela = np.array([89,127,134,152,170,172,182,192,197,210,219,222,233,226,222,205,222])
 	prediccion = linear_regression_predict(
@@ -0,0 +1,81 @@
+import numpy as np
+
+def pack_ragged(arrays, dtype = np.float64) :
+	"""Empaqueta una lista de arreglos de distinta longitud en una matriz
+	rellenada con ceros y una máscara que indica las posiciones válidas. Los
+	arreglos se alinean a la izquierda.
+
+	Args:
+		arrays (list): lista de numpy arrays de una dimensión.
+		dtype (:obj: `numpy.dtype`, opcional): tipo de dato de la matriz.
+
+	Returns:
+		matrix (:obj: `numpy.array`): matriz con dimensiones (m, n) donde m es
+			el número de arreglos y n la longitud del arreglo más largo.
+		mask (:obj: `numpy.array`): matriz booleana con dimensiones (m, n), es
+			True en las posiciones que contienen datos.
+	"""
+	lengths = np.array([len(array) for array in arrays], dtype = np.int64)
+	n = lengths.max() if len(arrays) else 0
+
+	mask = np.arange(n) < lengths[:, np.newaxis]
+	matrix = np.zeros((len(arrays), n), dtype = dtype)
+	if len(arrays) :
+		matrix[mask] = np.concatenate(arrays)
+
+	return matrix, mask
+
+def compute_metrics(Y, Y_hat, groups, mask = None) :
+	"""Calcula las métricas de evaluación de varias predicciones a la vez. Cada
+	renglón de las matrices es una predicción independiente.
+
+	Las métricas que calcula son las siguientes:
+	- Mean absolute error
+	- Root mean squared error
+	- Mean absolute percentage error
+	- Probabilidad de riesgo: proporción de los años en los que el error
+		absoluto es mayor o igual al promedio de alumnos por grupo.
+
+	Args:
+		Y (:obj: `numpy.array`): matriz con los datos reales con dimensiones (m, n).
+		Y_hat (:obj: `numpy.array`): matriz con los datos predichos con
+			dimensiones (m, n).
+		groups (:obj: `numpy.array`): promedio de alumnos por grupo, con
+			dimensiones (m,) para un valor por renglón o (m, n) para un valor
+			por posición.
+		mask (:obj: `numpy.array`, opcional): matriz booleana con dimensiones
+			(m, n) que indica las posiciones válidas, ver pack_ragged. Si no se
+			proporciona todas las posiciones son válidas.
+
+	Returns:
+		mae (:obj: `numpy.array`): arreglo con dimensiones (m,).
+		rmse (:obj: `numpy.array`): arreglo con dimensiones (m,).
+		mape (:obj: `numpy.array`): arreglo con dimensiones (m,).
+		pr (:obj: `numpy.array`): arreglo con dimensiones (m,).
+	"""
+	Y = np.asarray(Y, dtype = np.float64)
+	Y_hat = np.asarray(Y_hat, dtype = np.float64)
+	groups = np.asarray(groups, dtype = np.float64)
+	if groups.ndim == 1 :
+		groups = groups[:, np.newaxis]
+	if mask is None :
+		mask = np.ones(Y.shape, dtype = bool)
+
+	count = mask.sum(axis = 1)
+	error = np.where(mask, np.abs(Y_hat - Y), 0)
+
+	# Las posiciones de relleno contienen ceros, se ignoran en la división
+	with np.errstate(divide = 'ignore', invalid = 'ignore') :
+		percentage_error = np.where(mask, error / np.abs(Y), 0)
+
+		mae = error.sum(axis = 1) / count
+		rmse = np.sqrt(np.square(error).sum(axis = 1) / count)
+		mape = percentage_error.sum(axis = 1) / count
+		pr = (mask & (error >= groups)).sum(axis = 1) / count
+
+	return mae, rmse, mape, pr
+
+if __name__ == "__main__" :
+	Y, mask = pack_ragged([np.array([10, 12, 14]), np.array([5, 6])])
+	Y_hat, _ = pack_ragged([np.array([11, 12, 13]), np.array([5, 8])])
+	print(compute_metrics(Y, Y_hat, np.array([1, 1.5]), mask))
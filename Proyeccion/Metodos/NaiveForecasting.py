@@ -26,6 +26,39 @@ def naive_forecasting_predict(data, prediction_size) :
 	prediction += data[-1]
 	return prediction
 
+def evaluate_and_predict_nf_batch(data, prediction_size = 5) :
+	"""Función que devuelve la predicción de los datos históricos y los datos
+	futuros de varias series de tiempo aplicando Naive Forecasting. Las series 
+	se agrupan por longitud en matrices y cada grupo se resuelve en una sola 
+	operación.
+	
+	La predicción histórica de Naive Forecasting es la propia serie de tiempo.
+	
+	Args:
+		data (list): lista de numpy arrays de una dimensión, cada uno con los 
+			valores reales de una serie de tiempo.
+		prediction_size (int, opcional): número de años a predecir.
+	
+	Returns:
+		(list): lista de tuplas (prediction, train_prediction) en el mismo orden
+			que data, con dimensiones (prediction_size,) y (n,) respectivamente.
+	"""
+	results = [None] * len(data)
+	
+	# Agrupar las series por longitud
+	groups = dict()
+	for i in range(len(data)) :
+		groups.setdefault(len(data[i]), []).append(i)
+	
+	for indexes in groups.values() :
+		matrix = np.array([data[i] for i in indexes], dtype = np.float64)
+		# Broadcasting del último dato de cada serie
+		prediction = np.repeat(matrix[:, -1 :], prediction_size, axis = 1)
+		for j in range(len(indexes)) :
+			results[indexes[j]] = (prediction[j], matrix[j])
+	
+	return results
+
 if __name__ == '__main__' :
 	escuela = np.array([89,127,134,152,170,172,182,192,197,210,219,222,233,226,222,205,222])
 	prediccion = naive_forecasting_predict(
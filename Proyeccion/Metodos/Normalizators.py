@@ -1,5 +1,11 @@
 import numpy as np
 
+# Las normalizaciones aceptan una serie de tiempo con dimensiones (n,) o un lote
+# de series con dimensiones (m, n), en cuyo caso los parámetros se calculan por
+# renglón. Los lotes de series de distinta longitud se representan con una
+# matriz rellenada y una máscara de posiciones válidas, ver Metrics.pack_ragged.
+# Ninguna normalización modifica el arreglo que recibe.
+
 class Normalizator:
 	
 	def normalize(self, data) :
@@ -19,51 +25,67 @@ class MinMaxNormalizator(Normalizator) :
 
 	"""
 
-	def __init__(self, data, a = -1, b = 1) :
-		self.max = np.max(data)
-		self.min = np.min(data)
+	def __init__(self, data, a = -1, b = 1, mask = None) :
+		data = np.asarray(data)
+		keepdims = data.ndim > 1
+		if mask is None :
+			self.max = np.max(data, axis = -1, keepdims = keepdims)
+			self.min = np.min(data, axis = -1, keepdims = keepdims)
+		else :
+			# Las posiciones de relleno no se consideran en el mínimo y máximo
+			self.max = np.max(np.where(mask, data, -np.inf), axis = -1, keepdims = keepdims)
+			self.min = np.min(np.where(mask, data, np.inf), axis = -1, keepdims = keepdims)
+		self.mask = mask
 		self.a = a
 		self.b = b
 		assert(a < b)
 	
 	def normalize(self, data) :
-		if self.max == self.min :
-			# Caso especial, si todos los números son iguales MinMaxNormalizator se
-			# convierte en DummyNormalizator
-			return data
-		return self.a + ((data - self.min) * (self.b - self.a)) / (self.max - self.min)
+		# Caso especial, si todos los números de una serie son iguales
+		# MinMaxNormalizator se convierte en DummyNormalizator para esa serie
+		constant = self.max == self.min
+		scale = np.where(constant, 1, self.max - self.min)
+		result = np.where(constant, data, self.a + ((data - self.min) * (self.b - self.a)) / scale)
+		if self.mask is not None and np.shape(data) == np.shape(self.mask) :
+			result = np.where(self.mask, result, 0)
+		return result
 	
 	def denormalize(self, data) :
-		if self.max == self.min :
-			# Caso especial, si todos los números son iguales MinMaxNormalizator se
-			# convierte en DummyNormalizator
-			return data
-		return self.min + ((data - self.a) * (self.max - self.min)) / (self.b - self.a)
+		constant = self.max == self.min
+		return np.where(constant, data, self.min + ((data - self.a) * (self.max - self.min)) / (self.b - self.a))
 
 class DifferencingNormalizator(Normalizator) :
 	"""
 	y_i' = y_i - y_(i - 1)
 	"""
 	
-	def __init__(self, data) :
-		pass
+	def __init__(self, data, mask = None) :
+		self.mask = mask
 	
 	def normalize(self, data) :
-		self.last_value = data[-1]
-		return np.array([data[i] - data[i - 1] for i in range(1, len(data))])
-		
+		data = np.asarray(data)
+		if self.mask is None :
+			self.last_value = data[..., -1]
+			return np.diff(data, axis = -1)
+
+		# Último valor válido de cada serie, las series están alineadas a la
+		# izquierda
+		lengths = self.mask.sum(axis = -1)
+		self.last_value = data[np.arange(len(data)), lengths - 1]
+		return np.where(self.mask[:, 1 :], np.diff(data, axis = -1), 0)
+	
 	def denormalize(self, data) :
-		data[0] += self.last_value
-		for i in range(1, len(data)) :
-			data[i] += data[i - 1]
-		return data
+		last_value = np.asarray(self.last_value)
+		if last_value.ndim :
+			last_value = last_value[:, np.newaxis]
+		return last_value + np.cumsum(data, axis = -1)
 
 class DummyNormalizator(Normalizator) :
 	"""
 	y' = y
 	"""
 
-	def __init__(self) :
+	def __init__(self, data = None, mask = None) :
 		pass
 	
 	def normalize(self, data) :
@@ -78,3 +100,9 @@ if __name__ == "__main__" :
 	data = normalizator.normalize(data)
 	data = normalizator.denormalize(data)
 	print(data)
+	
+	# Lote de series de distinta longitud
+	from Metrics import pack_ragged
+	batch, mask = pack_ragged([np.array([5,2,8,3,-1]), np.array([4,4,4]), np.array([1,3])])
+	for normalizator in [MinMaxNormalizator(batch, mask = mask), DifferencingNormalizator(batch, mask)] :
+		print(normalizator.normalize(batch))
@@ -0,0 +1,24 @@
+import os
+
+from threadpoolctl import threadpool_limits
+
+# Variables de entorno con las que TensorFlow elige su número de hilos. Solo
+# tienen efecto si TensorFlow se importa después de asignarlas, lo que ocurre
+# en los procesos de los pools porque los métodos lo importan al entrenar.
+TF_THREAD_VARIABLES = ["TF_NUM_INTRAOP_THREADS", "TF_NUM_INTEROP_THREADS"]
+
+def limit_threads() :
+	"""Limita a un hilo las bibliotecas numéricas del proceso actual, para que
+	los procesos de un pool no compitan entre sí por los núcleos del equipo. Se
+	utiliza como initializer de los pools de UpdateScript.actualizar_proyeccion,
+	de UpdateScript.pool_expertos y de JupyterNotebooks/Evaluation.Model.test_set.
+
+	Las variables de entorno OMP_NUM_THREADS, OPENBLAS_NUM_THREADS y
+	MKL_NUM_THREADS no sirven para esto: las bibliotecas BLAS las leen al
+	cargarse, y numpy ya está importado en el proceso cuando se ejecuta el
+	initializer (heredado con fork o importado por el módulo de la función con
+	spawn). threadpoolctl cambia el límite de las bibliotecas ya cargadas.
+	"""
+	threadpool_limits(limits = 1)
+	for variable in TF_THREAD_VARIABLES :
+		os.environ[variable] = "1"
@@ -1,12 +1,40 @@
 import json
-import requests
-import getpass
 import sys
 import os
+import re
+import zlib
+import hashlib
+import importlib
+import subprocess
+import multiprocessing
+import time
+import functools
 import numpy as np
-import pandas as pd
 from datetime import datetime
 
+# Registro de los métodos de proyección. Cada método se importa hasta que una
+# escuela lo necesita por primera vez, ver cargar_metodo
+METODOS_PROYECCION = {
+    'EP' : ('Proyeccion.Metodos.ExpertsOpinion', 'evaluate_and_predict_ep'),
+    'EP_PRESUPUESTO' : ('Proyeccion.Metodos.ExpertsOpinion', 'evaluate_and_predict_ep_budgeted'),
+    'ARIMA' : ('Proyeccion.Metodos.AutoARIMA', 'evaluate_and_predict_arima'),
+    'SLR' : ('Proyeccion.Metodos.LinearRegression', 'evaluate_and_predict_slr'),
+    'SLR_LOTES' : ('Proyeccion.Metodos.LinearRegression', 'evaluate_and_predict_slr_batch'),
+    'NF_LOTES' : ('Proyeccion.Metodos.NaiveForecasting', 'evaluate_and_predict_nf_batch'),
+}
+
+METODOS_CARGADOS = dict()
+
+# Pool de procesos en el que se ejecutan los expertos de EP de forma 
+# concurrente, ver pool_expertos
+POOL_EXPERTOS = None
+
+CABECERA_PROYECCION = "cct,proyeccion_1,proyeccion_2,proyeccion_3,proyeccion_4,proyeccion_5,mae,rmse,mape,rp,metodo,expertos\n"
+
+# Expertos de la opinión de expertos completa, en el orden en el que los 
+# registra el modo con presupuesto
+EXPERTOS_EP = "ARIMA+FTS+ANN"
+
 def actualizar_datos_generales(archivo_credenciales = None, direccion = None) :
     """Función para actualizar los datos generales de las escuelas. Se conecta con
     el servidor de base de datos para obtener los datos, se guardan en el archivo
@@ -39,6 +67,8 @@ def actualizar_datos_generales(archivo_credenciales = None, direccion = None) :
             realiza la petición. Si no se proporciona se utilizará la dirección 
             por defecto.
     """
+    import requests
+    import getpass
     
     # Obtener credenciales
     if archivo_credenciales :
@@ -171,10 +201,142 @@ def informacion() :
                 nueva_proyeccion: realiza un respaldo y comienza una nueva proyección.
                 forzar_nueva_proyeccion: realiza un respaldo y forza el comienzo 
                     de una nueva proyección.
+                incremental: realiza un respaldo y comienza una nueva proyección
+                    en la que solo se proyectan las escuelas nuevas o cuya 
+                    matrícula o promedio de alumnos por grupo cambiaron desde la
+                    última proyección completa. Los renglones del resto de las
+                    escuelas se copian del respaldo. Las huellas de los datos
+                    con los que se calculó cada renglón de la última proyección
+                    completa se guardan en el archivo .ManifiestoProyeccion.json.
+                solo_prediccion: realiza un respaldo y comienza una nueva 
+                    proyección en la que las escuelas que se proyectan con EP y
+                    ARIMA reutilizan los modelos entrenados en una proyección 
+                    anterior en lugar de volver a entrenarlos, siempre que su
+                    matrícula no haya cambiado. Las escuelas sin modelos 
+                    guardados se entrenan normalmente. Los modelos entrenados 
+                    se guardan en el directorio .artefactos_proyeccion.
+            
+            workers (opcional):
+                Número de procesos en los que se reparten las escuelas. Se 
+                recomienda utilizar el número de núcleos del procesador. Por 
+                defecto es 1. Las escuelas que se proyectan con EP y ARIMA se
+                reparten primero, de la más costosa a la menos costosa, y las
+                escuelas que se proyectan con SLR y NF se reparten al final en
+                lotes grandes.
+            
+            shard (opcional):
+                Parte de las escuelas a proyectar con el formato i/N, para 
+                repartir la proyección entre N equipos. Cada equipo ejecuta el
+                comando con un valor distinto de i (de 1 a N) y guarda su 
+                proyección en el archivo .ProyeccionMatricula_parte_i_de_N.csv.
+                La asignación de las escuelas a las partes depende solo de su
+                cct, por lo que todos los equipos deben usar el mismo archivo
+                DatosGenerales.json. Las partes se unen con el comando 
+                fusionar_proyecciones. No se puede utilizar con el modo 
+                incremental.
+            
+            presupuesto_ep (opcional):
+                Segundos disponibles para proyectar cada escuela con opinión de
+                expertos (EP). Si se proporciona, EP comienza con el experto más
+                barato (ARIMA) y solo agrega expertos más costosos (FTS y la red
+                neuronal) mientras se espere que cambien la predicción promedio
+                en más de tolerancia_ep y quepan en el presupuesto, de modo que
+                las escuelas con matrícula casi constante se proyectan con un 
+                solo experto. Puede ser inf para no limitar el tiempo. Los 
+                expertos utilizados por cada escuela se registran en la columna
+                expertos del archivo de proyección. Por defecto se utilizan 
+                todos los expertos.
+            
+            tolerancia_ep (opcional):
+                Cambio relativo mínimo esperado de la predicción de EP para 
+                agregar un experto cuando se utiliza presupuesto_ep. Por defecto
+                es 0.01, es decir, 1% de la matrícula promedio de la escuela.
+            
+            expertos_concurrentes (opcional):
+                Si es True, los tres expertos de EP de cada escuela se ejecutan
+                al mismo tiempo en un pool de tres procesos que se crea una sola
+                vez. Solo se puede utilizar con workers=1, ya que los procesos 
+                de workers no pueden crear procesos, y no se puede utilizar 
+                junto con presupuesto_ep. Por defecto es False.
+            
+            timeout_ep (opcional):
+                Segundos que se espera a los expertos de EP de cada escuela. 
+                Requiere expertos_concurrentes=True. Los expertos que no 
+                terminan a tiempo se descartan del promedio y se detienen, por
+                lo que el pool de procesos se vuelve a crear para la siguiente
+                escuela. No se puede utilizar junto con presupuesto_ep.
+            
+            arranque_en_caliente (opcional):
+                Si es True, los modelos EP y ARIMA guardados de las escuelas 
+                que se vuelven a entrenar se utilizan como punto de partida: 
+                el orden previo del modelo ARIMA, la actualización del modelo 
+                ARIMA con los años nuevos y el ajuste de la red neuronal a 
+                partir de sus pesos. La proyección depende entonces de las 
+                proyecciones anteriores. Por defecto es False, es decir, los 
+                modelos se entrenan desde cero.
+            
+            lote_ep (opcional):
+                Número de escuelas EP cuyas redes neuronales se entrenan juntas
+                en un solo ciclo de entrenamiento. Las escuelas EP se reparten
+                entre los procesos en lotes de este tamaño y en cada lote las
+                redes de las escuelas que se entrenan desde cero se entrenan a
+                la vez, lo que es mucho más rápido que entrenarlas una por una.
+                Los modelos ARIMA y FTS se entrenan igual que sin esta opción.
+                No se puede utilizar junto con presupuesto_ep ni timeout_ep.
         
         Ejemplo de uso:
         
         $ python3.6 UpdateScript.py actualizar_proyeccion modo="nueva_proyeccion"
+        
+        $ python3.6 UpdateScript.py actualizar_proyeccion modo="reanudar" workers=8
+        
+        $ python3.6 UpdateScript.py actualizar_proyeccion modo="solo_prediccion"
+        
+        $ python3.6 UpdateScript.py actualizar_proyeccion modo="forzar_nueva_proyeccion" shard="2/4"
+        
+        $ python3.6 UpdateScript.py actualizar_proyeccion modo="forzar_nueva_proyeccion" presupuesto_ep=5
+        
+        $ python3.6 UpdateScript.py actualizar_proyeccion modo="forzar_nueva_proyeccion" expertos_concurrentes=True timeout_ep=60
+        
+        $ python3.6 UpdateScript.py actualizar_proyeccion modo="incremental" arranque_en_caliente=True
+        
+        $ python3.6 UpdateScript.py actualizar_proyeccion modo="forzar_nueva_proyeccion" lote_ep=64
+
+    fusionar_proyecciones :
+    
+        Une las proyecciones parciales .ProyeccionMatricula_parte_i_de_N.csv
+        en el archivo .ProyeccionMatricula.csv. Valida que se encuentren todas 
+        las partes, que estén completas, que ninguna escuela se repita y que
+        las escuelas sean las del archivo DatosGenerales.json. Antes de unirlas
+        realiza un respaldo en el directorio .respaldos_proyeccion.
+        
+        Parámetros disponibles:
+        
+            directorio (opcional):
+                Directorio en el que se encuentran los archivos de las partes.
+                Por defecto es el directorio actual.
+        
+        Ejemplo de uso:
+        
+        $ python3.6 UpdateScript.py fusionar_proyecciones
+
+    medir_inicio :
+    
+        Mide el tiempo que tarda en importarse este script y los módulos que 
+        necesita cada comando. Cada medición se realiza en un nuevo proceso de
+        Python. Los métodos de proyección solo se importan cuando una escuela
+        los necesita, por lo que el tiempo de actualizar_proyeccion depende de
+        los métodos de las escuelas a proyectar.
+        
+        Parámetros disponibles:
+        
+            repeticiones (opcional):
+                Número de veces que se repite cada medición, se reporta el 
+                menor tiempo. Por defecto es 3.
+        
+        Ejemplo de uso:
+        
+        $ python3.6 UpdateScript.py medir_inicio
 
     actualizar_datos_estado :
     
@@ -191,7 +353,818 @@ def informacion() :
     
     print(info)
 
-def actualizar_proyeccion(modo = "reanudar") :
+def cargar_metodo(nombre) :
+    """Devuelve la función de un método de proyección del registro 
+    METODOS_PROYECCION. El módulo del método y sus dependencias (TensorFlow,
+    pmdarima, pyFTS) se importan la primera vez que se solicita el método.
+    
+    Args:
+        nombre (str): nombre del método en METODOS_PROYECCION.
+    
+    Returns:
+        (function): función del método de proyección.
+    """
+    if nombre not in METODOS_CARGADOS :
+        modulo, funcion = METODOS_PROYECCION[nombre]
+        METODOS_CARGADOS[nombre] = getattr(importlib.import_module(modulo), funcion)
+    return METODOS_CARGADOS[nombre]
+
+def inicializar_proceso_expertos(listos) :
+    """Prepara un proceso del pool de los expertos de EP: limita los hilos de
+    las bibliotecas numéricas e importa los expertos con sus dependencias, de
+    modo que el tiempo de los expertos no incluya las importaciones.
+    
+    Args:
+        listos (:obj: `multiprocessing.Queue`): cola en la que el proceso avisa
+            que está listo.
+    """
+    from Proyeccion.Metodos.ThreadLimits import limit_threads
+    
+    limit_threads()
+    cargar_metodo('EP')
+    # La red neuronal importa TensorFlow hasta que se entrena
+    import tensorflow
+    listos.put(os.getpid())
+
+def pool_expertos() :
+    """Devuelve el pool de procesos en el que se ejecutan de forma concurrente
+    los expertos de EP, con un proceso por experto. El pool se crea la primera
+    vez que se solicita y se reutiliza en las escuelas siguientes hasta que se
+    descarta con descartar_pool_expertos. Al crearlo se espera a que todos sus
+    procesos estén listos, ver inicializar_proceso_expertos.
+    
+    Los procesos se crean con spawn, porque TensorFlow se bloquea en los 
+    procesos creados con fork después de inicializarse.
+    
+    Returns:
+        (:obj: `multiprocessing.pool.Pool`): pool de procesos de los expertos.
+    """
+    global POOL_EXPERTOS
+    if POOL_EXPERTOS is None :
+        procesos = len(EXPERTOS_EP.split('+'))
+        contexto = multiprocessing.get_context('spawn')
+        listos = contexto.Queue()
+        POOL_EXPERTOS = contexto.Pool(
+            processes = procesos,
+            initializer = inicializar_proceso_expertos,
+            initargs = (listos,)
+        )
+        for _ in range(procesos) :
+            listos.get()
+    return POOL_EXPERTOS
+
+def descartar_pool_expertos() :
+    """Detiene los procesos del pool de los expertos de EP, incluidos los 
+    expertos que siguen en ejecución. El siguiente llamado a pool_expertos
+    crea un pool nuevo.
+    """
+    global POOL_EXPERTOS
+    if POOL_EXPERTOS is not None :
+        POOL_EXPERTOS.terminate()
+        POOL_EXPERTOS.join()
+        POOL_EXPERTOS = None
+
+def metodo_escuela(matricula) :
+    """Elige el método de proyección de una escuela según el número de años de
+    matrícula que tiene registrados.
+    
+    Args:
+        matricula (list): matrícula de la escuela año con año.
+    
+    Returns:
+        (str): 'EP' (opinión de expertos), 'ARIMA', 'SLR' (regresión lineal
+            simple) o 'NF' (naive forecasting).
+    """
+    if len(matricula) > 8 :
+        return 'EP'
+    elif len(matricula) > 4 :
+        return 'ARIMA'
+    elif len(matricula) > 1 :
+        return 'SLR'
+    else :
+        return 'NF'
+
+# Costo aproximado en segundos de cada método: (costo fijo, costo por año)
+COSTO_METODOS = {
+    'EP' : (8.0, 0.25),
+    'ARIMA' : (1.0, 0.05),
+    'SLR' : (1e-3, 0.0),
+    'NF' : (1e-4, 0.0)
+}
+
+def estimar_costo(matricula) :
+    """Estima el tiempo de cómputo de la proyección de una escuela a partir del
+    método que le corresponde y del número de años de su matrícula.
+    
+    Args:
+        matricula (list): matrícula de la escuela año con año.
+    
+    Returns:
+        (float): costo estimado en segundos.
+    """
+    costo_fijo, costo_anio = COSTO_METODOS[metodo_escuela(matricula)]
+    return costo_fijo + costo_anio * len(matricula)
+
+def planificar_tareas(tareas, tam_lote_barato = 500, tam_lote_ep = 1) :
+    """Agrupa las tareas de proyección en lotes para repartirlos entre los
+    procesos. Las escuelas costosas (EP y ARIMA) forman lotes individuales
+    ordenados del más costoso al menos costoso (longest processing time first),
+    de modo que ningún proceso termine con una escuela costosa al final. Las
+    escuelas baratas (SLR y NF) se agrupan en lotes grandes que se reparten al
+    final para rellenar los procesos que terminen primero.
+    
+    Args:
+        tareas (list): lista de tuplas (cct, matricula, matricula_por_grupo).
+        tam_lote_barato (int, opcional): número de escuelas baratas por lote.
+        tam_lote_ep (int, opcional): número de escuelas EP por lote, ver 
+            proyectar_lote. Los lotes EP se ordenan por su costo total junto
+            con los lotes ARIMA.
+    
+    Returns:
+        (list): lista de lotes, cada lote es una lista de tareas.
+    """
+    costosas = []
+    baratas = []
+    for tarea in tareas :
+        if metodo_escuela(tarea[1]) in ['EP', 'ARIMA'] :
+            costosas.append(tarea)
+        else :
+            baratas.append(tarea)
+    
+    costosas.sort(key = lambda tarea : estimar_costo(tarea[1]), reverse = True)
+    ep = [tarea for tarea in costosas if metodo_escuela(tarea[1]) == 'EP']
+    lotes = [[tarea] for tarea in costosas if metodo_escuela(tarea[1]) != 'EP']
+    lotes += [ep[i : i + tam_lote_ep] for i in range(0, len(ep), tam_lote_ep)]
+    lotes.sort(key = lambda lote : sum(estimar_costo(tarea[1]) for tarea in lote), reverse = True)
+    for i in range(0, len(baratas), tam_lote_barato) :
+        lotes.append(baratas[i : i + tam_lote_barato])
+    
+    return lotes
+
+def cargar_artefactos(cct, matricula, metodo_artefactos, solo_prediccion = False, arranque_en_caliente = False) :
+    """Carga los modelos guardados de una escuela que se proyecta con EP o 
+    ARIMA y decide si se deben volver a entrenar. Solo se omite el 
+    entrenamiento si los modelos fueron entrenados con la misma matrícula y
+    el mismo método.
+    
+    Args:
+        cct (str): clave de la escuela.
+        matricula (:obj: `numpy.array`): matrícula de la escuela año con año.
+        metodo_artefactos (str): método con el que se entrenan los modelos,
+            ver proyectar_escuela.
+        solo_prediccion (bool, opcional): ver proyectar_escuela.
+        arranque_en_caliente (bool, opcional): ver proyectar_escuela.
+    
+    Returns:
+        almacen (:obj: `ArtifactStore`): almacén de los modelos.
+        artefactos (dict): modelos de la escuela. Si se deben entrenar y no
+            se entrena en caliente el diccionario solo contiene la huella y el
+            método.
+        entrenar (bool): True si se deben entrenar los modelos.
+    """
+    from Proyeccion.Metodos.ArtifactStore import ArtifactStore, series_hash
+    
+    almacen = ArtifactStore()
+    huella = series_hash(matricula)
+    artefactos = almacen.load(cct) or dict()
+    entrenar = not solo_prediccion or artefactos.get('hash') != huella \
+        or artefactos.get('metodo') != metodo_artefactos
+    if entrenar :
+        if not arranque_en_caliente :
+            # Entrenar desde cero, los métodos solo parten de los modelos
+            # guardados que reciben en sus artefactos
+            artefactos = dict()
+        artefactos.update(hash = huella, metodo = metodo_artefactos)
+    return almacen, artefactos, entrenar
+
+def proyectar_escuela(tarea, solo_prediccion = False, presupuesto_ep = None, tolerancia_ep = 0.01, timeout_ep = None,
+    arranque_en_caliente = False, ann_precalculada = None, expertos_concurrentes = False) :
+    """Realiza la proyección de matrícula de una sola escuela. Elige el método
+    de proyección según el número de años de matrícula de la escuela.
+    
+    Los modelos entrenados de las escuelas que se proyectan con EP y ARIMA se
+    guardan en el directorio .artefactos_proyeccion junto con la huella de la
+    matrícula con la que fueron entrenados.
+    
+    Args:
+        tarea (tuple): tupla (cct, matricula, matricula_por_grupo) con la clave
+            de la escuela, la lista de su matrícula año con año y su promedio
+            de alumnos por grupo.
+        solo_prediccion (bool, opcional): si es True y existen modelos 
+            guardados de la escuela entrenados con la misma matrícula, la 
+            predicción se realiza con ellos sin volver a entrenar.
+        presupuesto_ep (float, opcional): segundos disponibles para proyectar
+            la escuela con EP. Si se proporciona, los expertos se agregan del
+            más barato al más costoso mientras se espere que cambien la 
+            predicción promedio en más de tolerancia_ep y quepan en el 
+            presupuesto, ver evaluate_and_predict_ep_budgeted. Si no se 
+            proporciona se utilizan todos los expertos.
+        tolerancia_ep (float, opcional): cambio relativo mínimo esperado de la
+            predicción de EP para agregar un experto. Solo se utiliza junto 
+            con presupuesto_ep.
+        timeout_ep (float, opcional): segundos que se espera a los expertos de
+            EP. Los expertos que no terminan a tiempo se descartan y el pool de
+            los expertos se descarta para detenerlos, ver 
+            evaluate_and_predict_ep. Solo se utiliza con expertos_concurrentes.
+        arranque_en_caliente (bool, opcional): si es True y la escuela se 
+            vuelve a entrenar, los modelos guardados se utilizan como punto de
+            partida del entrenamiento, por ejemplo el orden previo del modelo
+            ARIMA. Si es False los modelos se entrenan desde cero y la 
+            proyección no depende de las proyecciones anteriores.
+        ann_precalculada (tuple, opcional): resultado de la red neuronal de
+            EP entrenada previamente junto con las de otras escuelas, ver 
+            entrenar_ann_lote. Si se proporciona la red no se vuelve a 
+            entrenar.
+        expertos_concurrentes (bool, opcional): si es True los expertos de EP
+            se ejecutan de forma concurrente en el pool de pool_expertos. Solo
+            se utiliza sin presupuesto_ep y en el proceso principal.
+    
+    Returns:
+        (tuple): tupla (cct, proyeccion_futura, proyeccion_historica, 
+            matricula_historica_real, matricula_por_grupo, metodo, expertos),
+            ver construir_renglones.
+    """
+    cct, matricula, matricula_por_grupo = tarea
+    matricula = np.array(matricula)
+    metodo = metodo_escuela(matricula)
+    expertos = metodo
+    
+    # Los expertos guardados en el modo con presupuesto pueden ser solo una
+    # parte de los de EP, por lo que sus artefactos se distinguen
+    metodo_artefactos = metodo
+    if metodo == 'EP' and presupuesto_ep is not None :
+        metodo_artefactos = 'EP_PRESUPUESTO'
+    
+    if metodo in ['EP', 'ARIMA'] :
+        almacen, artefactos, entrenar = cargar_artefactos(
+            cct, matricula, metodo_artefactos, solo_prediccion, arranque_en_caliente)
+    
+    # Obtener predicción futura e histórica
+    if metodo_artefactos == 'EP_PRESUPUESTO' :
+        proy_matricula_futura, proy_matricula_historica, usados = cargar_metodo('EP_PRESUPUESTO')(
+            matricula,
+            tolerance = tolerancia_ep,
+            budget = presupuesto_ep,
+            artifacts = artefactos,
+            train = entrenar
+        )
+        matricula_historica_real = matricula[5:]
+        expertos = '+'.join(usados)
+    elif metodo == 'EP' :
+        evaluate_and_predict_ep = cargar_metodo('EP')
+        pool = pool_expertos() if expertos_concurrentes else None
+        terminados = []
+        try :
+            proy_matricula_futura, proy_matricula_historica = evaluate_and_predict_ep(
+                matricula,
+                artifacts = artefactos,
+                train = entrenar,
+                pool = pool,
+                timeout = timeout_ep,
+                finished_experts = terminados,
+                precomputed = None if ann_precalculada is None else {'evaluate_and_predict_ann' : ann_precalculada}
+            )
+        except BaseException :
+            if pool is not None :
+                descartar_pool_expertos()
+            raise
+        if pool is not None and len(terminados) < len(EXPERTOS_EP.split('+')) :
+            # Detener a los expertos que no terminaron a tiempo para que no
+            # ocupen los procesos de la siguiente escuela
+            descartar_pool_expertos()
+        matricula_historica_real = matricula[5:]
+        # Registrar solo los expertos que terminaron a tiempo
+        from Proyeccion.Metodos.ExpertsOpinion import EXPERT_LABELS
+        expertos = '+'.join(sorted(
+            (EXPERT_LABELS[nombre] for nombre in terminados),
+            key = EXPERTOS_EP.split('+').index
+        ))
+    elif metodo == 'ARIMA' :
+        proy_matricula_futura, proy_matricula_historica = cargar_metodo('ARIMA')(
+            matricula,
+            OFFSET_ANIOS = 0,
+            artifact = artefactos.setdefault('evaluate_and_predict_arima', dict()),
+            train = entrenar
+        )
+        matricula_historica_real = matricula
+    elif metodo == 'SLR' :
+        proy_matricula_futura, proy_matricula_historica = cargar_metodo('SLR')(matricula)
+        matricula_historica_real = matricula
+    else :
+        proy_matricula_futura = np.array([matricula[0]] * 5)
+        proy_matricula_historica = np.array(matricula)
+        matricula_historica_real = matricula
+    
+    if metodo in ['EP', 'ARIMA'] and entrenar :
+        almacen.save(cct, artefactos)
+    
+    return cct, proy_matricula_futura, proy_matricula_historica, matricula_historica_real, matricula_por_grupo, metodo, expertos
+
+def construir_renglones(resultados) :
+    """Calcula las métricas de error de la predicción histórica de varias 
+    escuelas en una sola operación vectorizada y construye sus renglones de 
+    resultados.
+    
+    Args:
+        resultados (list): lista de tuplas (cct, proyeccion_futura, 
+            proyeccion_historica, matricula_historica_real, matricula_por_grupo,
+            metodo, expertos) con la predicción de los próximos 5 años, la 
+            predicción histórica, la matrícula real de los años de la 
+            predicción histórica, el promedio de alumnos por grupo, el método
+            utilizado y los expertos utilizados (el método mismo si no es EP).
+    
+    Returns:
+        (list): lista de tuplas (cct, proyeccion, mae, rmse, mape, rp, metodo,
+            expertos).
+    """
+    from Proyeccion.Metodos.Metrics import pack_ragged, compute_metrics
+    
+    if not resultados :
+        return []
+    
+    ccts, futuras, historicas, reales, grupos, metodos, expertos = zip(*resultados)
+    
+    # Calcular los errores
+    Y_hat, mascara = pack_ragged(historicas)
+    Y, _ = pack_ragged(reales)
+    mae, rmse, mape, pr = compute_metrics(Y, Y_hat, np.array(grupos), mascara)
+    
+    futuras = np.array(futuras, dtype = np.float64).astype(np.int64)
+    
+    return [
+        (ccts[i], futuras[i], mae[i], rmse[i], mape[i], pr[i], metodos[i], expertos[i])
+        for i in range(len(ccts))
+    ]
+
+def entrenar_ann_lote(tareas, solo_prediccion = False, arranque_en_caliente = False) :
+    """Entrena juntas las redes neuronales de EP de varias escuelas, ver
+    evaluate_and_predict_ann_batch. Solo se entrenan las redes de las escuelas
+    que se deben volver a entrenar desde cero: las que reutilizan sus modelos
+    (solo_prediccion) o ajustan su red guardada (arranque_en_caliente) se 
+    proyectan después como cualquier otra escuela.
+    
+    Args:
+        tareas (list): lista de tuplas (cct, matricula, matricula_por_grupo)
+            de escuelas que se proyectan con EP.
+        solo_prediccion (bool, opcional): ver proyectar_escuela.
+        arranque_en_caliente (bool, opcional): ver proyectar_escuela.
+    
+    Returns:
+        (dict): resultados de la red neuronal de cada escuela indexados por 
+            cct, ver el parámetro ann_precalculada de proyectar_escuela.
+    """
+    from Proyeccion.Metodos.IndividualANN import evaluate_and_predict_ann_batch
+    
+    ccts = []
+    matriculas = []
+    for cct, matricula, _ in tareas :
+        matricula = np.array(matricula)
+        _, artefactos, entrenar = cargar_artefactos(cct, matricula, 'EP', solo_prediccion, arranque_en_caliente)
+        artefacto_ann = artefactos.get('evaluate_and_predict_ann', dict())
+        if entrenar and not ('weights' in artefacto_ann and artefacto_ann.get('learning_rate') is not None) :
+            ccts.append(cct)
+            matriculas.append(matricula)
+    
+    if not ccts :
+        return dict()
+    
+    artefactos_ann = [dict() for _ in ccts]
+    resultados = evaluate_and_predict_ann_batch(matriculas, artifacts = artefactos_ann)
+    return {
+        ccts[i] : (resultados[i][0], resultados[i][1], artefactos_ann[i])
+        for i in range(len(ccts))
+    }
+
+def proyectar_lote(lote, solo_prediccion = False, presupuesto_ep = None, tolerancia_ep = 0.01, timeout_ep = None,
+    arranque_en_caliente = False, lote_ep = None, expertos_concurrentes = False) :
+    """Realiza la proyección de matrícula de un lote de escuelas. Las escuelas
+    que se proyectan con SLR y NF se agrupan y se proyectan con las versiones
+    por lotes de estos métodos, el resto se proyecta una por una. Si se 
+    proporciona lote_ep, las redes neuronales de las escuelas EP del lote se
+    entrenan juntas antes de proyectarlas, ver entrenar_ann_lote.
+    
+    Args:
+        lote (list): lista de tuplas (cct, matricula, matricula_por_grupo).
+        solo_prediccion (bool, opcional): ver proyectar_escuela.
+        presupuesto_ep (float, opcional): ver proyectar_escuela.
+        tolerancia_ep (float, opcional): ver proyectar_escuela.
+        timeout_ep (float, opcional): ver proyectar_escuela.
+        arranque_en_caliente (bool, opcional): ver proyectar_escuela.
+        lote_ep (int, opcional): número de escuelas EP por lote, ver
+            actualizar_proyeccion. No se utiliza junto con presupuesto_ep ni
+            timeout_ep.
+        expertos_concurrentes (bool, opcional): ver proyectar_escuela.
+    
+    Returns:
+        (list): lista de tuplas (cct, proyeccion, mae, rmse, mape, rp, metodo,
+            expertos), ver construir_renglones.
+    """
+    anns_precalculadas = dict()
+    if lote_ep is not None :
+        tareas_ep = [tarea for tarea in lote if metodo_escuela(tarea[1]) == 'EP']
+        if tareas_ep :
+            anns_precalculadas = entrenar_ann_lote(tareas_ep, solo_prediccion, arranque_en_caliente)
+    
+    resultados_lote = []
+    tareas_por_lotes = {'SLR' : [], 'NF' : []}
+    for tarea in lote :
+        metodo = metodo_escuela(tarea[1])
+        if metodo in tareas_por_lotes :
+            tareas_por_lotes[metodo].append(tarea)
+        else :
+            resultados_lote.append(proyectar_escuela(
+                tarea, solo_prediccion, presupuesto_ep, tolerancia_ep, timeout_ep, arranque_en_caliente,
+                anns_precalculadas.get(tarea[0]), expertos_concurrentes))
+    
+    for metodo in ['SLR', 'NF'] :
+        tareas = tareas_por_lotes[metodo]
+        if not tareas :
+            continue
+        
+        matriculas = [np.array(matricula) for _, matricula, _ in tareas]
+        resultados = cargar_metodo(metodo + '_LOTES')(matriculas)
+        
+        for i in range(len(tareas)) :
+            cct, _, matricula_por_grupo = tareas[i]
+            proy_matricula_futura, proy_matricula_historica = resultados[i]
+            resultados_lote.append((
+                cct,
+                proy_matricula_futura,
+                proy_matricula_historica,
+                matriculas[i],
+                matricula_por_grupo,
+                metodo,
+                metodo
+            ))
+    
+    return construir_renglones(resultados_lote)
+
+def formatear_renglon(renglon) :
+    """Convierte un renglón de resultados de construir_renglones en un renglón
+    del archivo .ProyeccionMatricula.csv
+    
+    Args:
+        renglon (tuple): tupla (cct, proyeccion, mae, rmse, mape, rp, metodo,
+            expertos) devuelta por construir_renglones.
+    
+    Returns:
+        (str): renglón del archivo csv terminado en salto de línea.
+    """
+    cct, proy_matricula_futura, mae, rmse, mape, pr, metodo, expertos = renglon
+    return "%s,%d,%d,%d,%d,%d,%.2lf,%.2lf,%.2lf,%.2lf,%s,%s\n" % (
+        cct,
+        proy_matricula_futura[0],
+        proy_matricula_futura[1],
+        proy_matricula_futura[2],
+        proy_matricula_futura[3],
+        proy_matricula_futura[4],
+        mae,
+        rmse,
+        mape,
+        pr,
+        metodo,
+        expertos
+    )
+
+def expertos_metodo(metodo) :
+    """Devuelve los expertos de los renglones de las versiones anteriores del
+    archivo de proyección, que no tienen la columna expertos. Esas versiones
+    utilizaban siempre los tres expertos del método EP.
+    
+    Args:
+        metodo (str): método de proyección del renglón.
+    
+    Returns:
+        (str): expertos que corresponden al método.
+    """
+    return EXPERTOS_EP if metodo == 'EP' else metodo
+
+def leer_renglones_proyeccion(nombre_archivo) :
+    """Lee los renglones de un archivo csv de proyección y los indexa por cct.
+    Descarta los renglones incompletos o inválidos. A los renglones de las 
+    versiones anteriores del archivo, que no tienen la columna expertos, se les
+    agregan los expertos que corresponden a su método.
+    
+    Args:
+        nombre_archivo (str): nombre del archivo csv de la proyección.
+    
+    Returns:
+        renglones (dict): diccionario con los renglones completos del archivo
+            (terminados en salto de línea) indexados por cct.
+        valido (bool): False si el archivo no existe, está vacío, contiene
+            renglones inválidos o tiene la cabecera de una versión anterior,
+            True en otro caso.
+    """
+    contenido = ''
+    if os.path.exists(nombre_archivo) :
+        with open(nombre_archivo, 'r') as archivo :
+            contenido = archivo.read()
+    
+    renglones = dict()
+    num_campos = CABECERA_PROYECCION.count(',') + 1
+    lineas = contenido.split('\n')
+    # El último elemento es '' si el archivo termina en salto de línea, en
+    # otro caso es un renglón incompleto que se descarta
+    incompleto = lineas.pop()
+    if incompleto :
+        print("Descartando renglón incompleto: %s" % (incompleto))
+    
+    for linea in lineas[1 :] :
+        campos = linea.split(',')
+        if len(campos) == num_campos - 1 :
+            # Renglón sin la columna expertos
+            linea += ',' + expertos_metodo(campos[-1])
+        elif len(campos) != num_campos :
+            print("Descartando renglón inválido: %s" % (linea))
+            continue
+        renglones[campos[0]] = linea + '\n'
+    
+    valido = bool(lineas) and lineas[0] + '\n' == CABECERA_PROYECCION \
+        and not incompleto and len(renglones) == len(lineas) - 1
+    return renglones, valido
+
+def escribir_proyeccion(nombre_archivo, renglones, ccts) :
+    """Escribe de forma atómica un archivo csv de proyección con los renglones
+    de las escuelas indicadas, en el orden dado. Las escuelas sin renglón se
+    omiten.
+    
+    Args:
+        nombre_archivo (str): nombre del archivo csv de la proyección.
+        renglones (dict): renglones terminados en salto de línea indexados por cct.
+        ccts (list): lista con los cct de las escuelas en el orden en el que
+            se escribirán.
+    """
+    nombre_temporal = nombre_archivo + '.tmp'
+    with open(nombre_temporal, 'w') as archivo :
+        archivo.write(CABECERA_PROYECCION)
+        archivo.write(''.join(renglones[cct] for cct in ccts if cct in renglones))
+        archivo.flush()
+        os.fsync(archivo.fileno())
+    os.replace(nombre_temporal, nombre_archivo)
+
+def leer_huellas(nombre_archivo) :
+    """Lee el archivo de huellas de una bitácora de proyección, ver
+    BitacoraProyeccion. Descarta los renglones incompletos.
+    
+    Args:
+        nombre_archivo (str): nombre del archivo de huellas.
+    
+    Returns:
+        (dict): huellas indexadas por cct, vacío si el archivo no existe.
+    """
+    huellas = dict()
+    if not os.path.exists(nombre_archivo) :
+        return huellas
+    with open(nombre_archivo, 'r') as archivo :
+        for linea in archivo :
+            campos = linea.rstrip('\n').split(',')
+            if linea.endswith('\n') and len(campos) == 2 :
+                huellas[campos[0]] = campos[1]
+    return huellas
+
+def escribir_huellas(nombre_archivo, huellas) :
+    """Reescribe de forma atómica el archivo de huellas de una bitácora de
+    proyección, ver BitacoraProyeccion.
+    
+    Args:
+        nombre_archivo (str): nombre del archivo de huellas.
+        huellas (dict): huellas indexadas por cct.
+    """
+    with open(nombre_archivo + ".tmp", "w") as archivo :
+        archivo.write(''.join("%s,%s\n" % (cct, huella) for cct, huella in huellas.items()))
+    os.replace(nombre_archivo + ".tmp", nombre_archivo)
+
+def guardar_manifiesto(huellas) :
+    """Guarda de forma atómica en el archivo .ManifiestoProyeccion.json las
+    huellas de los datos con los que se completó la proyección.
+    
+    Args:
+        huellas (dict): huellas de las escuelas indexadas por cct.
+    """
+    with open(".ManifiestoProyeccion.json.tmp", "w") as archivo_manifiesto :
+        json.dump(huellas, archivo_manifiesto, separators = (',', ':'))
+    os.replace(".ManifiestoProyeccion.json.tmp", ".ManifiestoProyeccion.json")
+
+def parte_escuela(cct, num_partes) :
+    """Asigna de forma determinista una escuela a una de las partes en las que
+    se divide la proyección. La asignación depende únicamente del cct, por lo
+    que es la misma en todos los equipos.
+    
+    Args:
+        cct (str): clave de la escuela.
+        num_partes (int): número total de partes.
+    
+    Returns:
+        (int): número de la parte, entre 1 y num_partes.
+    """
+    return zlib.crc32(cct.encode()) % num_partes + 1
+
+def archivo_parte(parte, num_partes) :
+    """Devuelve el nombre del archivo de proyección parcial de una parte.
+    
+    Args:
+        parte (int): número de la parte, entre 1 y num_partes.
+        num_partes (int): número total de partes.
+    
+    Returns:
+        (str): nombre del archivo csv de la parte.
+    """
+    return ".ProyeccionMatricula_parte_%d_de_%d.csv" % (parte, num_partes)
+
+def cargar_datos_generales() :
+    """Carga las escuelas del archivo DatosGenerales.json.
+    
+    Returns:
+        (dict): datos generales de las escuelas indexados por cct.
+    
+    Raises:
+        FileNotFoundError: si no existe el archivo DatosGenerales.json.
+    """
+    with open("DatosGenerales.json") as f :
+        escuelas = json.load(f)['result'][0]
+    
+    # Borrar registros que no son escuelas
+    if '@type' in escuelas :
+        escuelas.pop('@type')
+    if '@version' in escuelas :
+        escuelas.pop('@version')
+    
+    return escuelas
+
+def huella_escuela(escuela) :
+    """Calcula una huella (hash) de los datos de una escuela que intervienen en
+    su proyección: la matrícula y el promedio de alumnos por grupo.
+    
+    Args:
+        escuela (dict): datos generales de la escuela.
+    
+    Returns:
+        (str): huella sha1 en hexadecimal.
+    """
+    datos = json.dumps([escuela['matricula'], escuela['prom_alumnos_grupo']])
+    return hashlib.sha1(datos.encode()).hexdigest()
+
+def respaldar_proyeccion(nombre_archivo) :
+    """Crea un respaldo del archivo de proyección en el directorio
+    .respaldos_proyeccion si es que existe.
+    
+    Args:
+        nombre_archivo (str): nombre del archivo csv de la proyección.
+    
+    Returns:
+        (str): ruta del respaldo creado o None si no existía el archivo.
+    """
+    try :
+        csv_proyeccion_matricula = open(nombre_archivo, "r")
+    except FileNotFoundError :
+        print("No se encontró ningún archivo con información previa de proyección de matrícula")
+        print("Omitiendo respaldo")
+        return None
+    
+    now = datetime.now()
+    nombre_nuevo_respaldo = "Respaldo_%02d-%02d-%02d_%02d:%02d:%02d.csv" % (
+        now.day, 
+        now.month, 
+        now.year, 
+        now.hour, 
+        now.minute, 
+        now.second
+    )
+    if not os.path.exists('.respaldos_proyeccion') :
+        os.makedirs('.respaldos_proyeccion')
+    ruta_respaldo = ".respaldos_proyeccion/%s" % (nombre_nuevo_respaldo)
+    nuevo_respaldo = open(ruta_respaldo, "w+")
+    nuevo_respaldo.write(csv_proyeccion_matricula.read())
+    nuevo_respaldo.close()
+    csv_proyeccion_matricula.close()
+    print("Respaldo realizado con nombre %s" % (nombre_nuevo_respaldo))
+    return ruta_respaldo
+
+class BitacoraProyeccion :
+    """Bitácora de solo escritura al final (append-only) de las escuelas ya
+    proyectadas. Utiliza el propio archivo csv de la proyección y lo indexa por
+    cct, de modo que al reanudar se omiten exactamente las escuelas terminadas
+    sin importar el orden en el que se proyectaron ni el orden de las llaves de
+    DatosGenerales.json.
+    
+    Los renglones se escriben por lotes. Cada lote se escribe con una sola
+    llamada a write y se sincroniza con el disco, por lo que una interrupción
+    solo puede dejar incompleto el último renglón, el cual se descarta al
+    cargar la bitácora.
+    
+    Junto a cada renglón se registra la huella de los datos con los que se
+    proyectó (ver huella_escuela) en el archivo nombre_archivo + ".huellas",
+    con un renglón "cct,huella" por escuela. El manifiesto de la proyección se
+    construye con estas huellas, de modo que describe los datos con los que se
+    calculó cada renglón aunque la proyección se haya reanudado con datos más
+    recientes. Las escuelas sin huella registrada se consideran desconocidas.
+    """
+    
+    def __init__(self, nombre_archivo, tam_lote = 50, intervalo = 30) :
+        """Constructor de la clase BitacoraProyeccion. Carga los renglones
+        previamente escritos en el archivo y lo prepara para agregar nuevos.
+        
+        Args:
+            nombre_archivo (str): nombre del archivo csv de la proyección. Si
+                no existe o está vacío se crea con la cabecera.
+            tam_lote (int, opcional): número de renglones que se acumulan antes
+                de escribirlos en el archivo.
+            intervalo (float, opcional): número máximo de segundos que un
+                renglón puede permanecer sin escribirse en el archivo.
+        """
+        self.nombre_archivo = nombre_archivo
+        self.tam_lote = tam_lote
+        self.intervalo = intervalo
+        
+        # Renglones completos indexados por cct
+        self.completadas = dict()
+        self.pendientes = []
+        self.ultima_escritura = time.time()
+        
+        self.completadas, valido = leer_renglones_proyeccion(nombre_archivo)
+        self.archivo_huellas = nombre_archivo + ".huellas"
+        self.huellas = leer_huellas(self.archivo_huellas)
+        self.huellas_pendientes = []
+        if not valido :
+            # Reescribir el archivo únicamente con los renglones válidos
+            self.reescribir(list(self.completadas.keys()))
+        
+        self.descriptor = os.open(nombre_archivo, os.O_WRONLY | os.O_APPEND)
+        self.descriptor_huellas = os.open(self.archivo_huellas, os.O_WRONLY | os.O_APPEND | os.O_CREAT)
+    
+    def registrar(self, renglon, huella) :
+        """Agrega el renglón de una escuela a la bitácora. El renglón se escribe
+        en el archivo cuando se completa el lote o cuando pasa el intervalo de
+        tiempo desde la última escritura.
+        
+        Args:
+            renglon (tuple): tupla devuelta por construir_renglones.
+            huella (str): huella de los datos con los que se proyectó la
+                escuela, ver huella_escuela.
+        """
+        self.registrar_linea(renglon[0], formatear_renglon(renglon), huella)
+    
+    def registrar_linea(self, cct, linea, huella) :
+        """Agrega a la bitácora un renglón ya formateado.
+        
+        Args:
+            cct (str): clave de la escuela.
+            linea (str): renglón del archivo csv terminado en salto de línea.
+            huella (str): huella de los datos con los que se calculó el renglón.
+        """
+        self.completadas[cct] = linea
+        self.huellas[cct] = huella
+        self.pendientes.append(linea)
+        self.huellas_pendientes.append("%s,%s\n" % (cct, huella))
+        
+        if len(self.pendientes) >= self.tam_lote or time.time() - self.ultima_escritura >= self.intervalo :
+            self.vaciar()
+    
+    def vaciar(self) :
+        """Escribe en el archivo los renglones pendientes de forma atómica."""
+        if self.pendientes :
+            os.write(self.descriptor, ''.join(self.pendientes).encode())
+            os.fsync(self.descriptor)
+            self.pendientes = []
+            # Las huellas se escriben después de sus renglones. Si se
+            # interrumpe entre ambas escrituras el renglón queda sin huella y
+            # se considera desconocido
+            os.write(self.descriptor_huellas, ''.join(self.huellas_pendientes).encode())
+            os.fsync(self.descriptor_huellas)
+            self.huellas_pendientes = []
+        self.ultima_escritura = time.time()
+    
+    def cerrar(self) :
+        """Escribe los renglones pendientes y cierra los archivos."""
+        self.vaciar()
+        os.close(self.descriptor)
+        os.close(self.descriptor_huellas)
+    
+    def manifiesto(self, ccts) :
+        """Devuelve las huellas registradas de los renglones de las escuelas
+        indicadas. Las escuelas sin huella registrada se omiten.
+        
+        Args:
+            ccts (list): lista con los cct de las escuelas.
+        
+        Returns:
+            (dict): huellas indexadas por cct.
+        """
+        return {cct : self.huellas[cct] for cct in ccts if cct in self.completadas and cct in self.huellas}
+    
+    def reescribir(self, ccts) :
+        """Reescribe el archivo de forma atómica con los renglones de las
+        escuelas indicadas, en el orden dado. Las escuelas sin renglón se omiten.
+        
+        Args:
+            ccts (list): lista con los cct de las escuelas en el orden en el
+                que se escribirán.
+        """
+        escribir_proyeccion(self.nombre_archivo, self.completadas, ccts)
+        escribir_huellas(self.archivo_huellas, self.manifiesto(ccts))
+
+def actualizar_proyeccion(modo = "reanudar", workers = 1, shard = None, presupuesto_ep = None, tolerancia_ep = 0.01,
+    timeout_ep = None, arranque_en_caliente = False, lote_ep = None, expertos_concurrentes = False) :
     """Realiza la proyección de matrículas de todas las escuelas que se encuentren
     en el archivo DatosGenerales.json
     
@@ -203,21 +1176,113 @@ def actualizar_proyeccion(modo = "reanudar") :
             nueva_proyeccion: realiza un respaldo y comienza una nueva proyección.
             forzar_nueva_proyeccion: realiza un respaldo y forza el comienzo 
                 de una nueva proyección.
+            incremental: realiza un respaldo y comienza una nueva proyección
+                en la que solo se proyectan las escuelas nuevas o cuyos datos
+                cambiaron desde la última proyección completa. Los renglones
+                del resto de las escuelas se copian del respaldo.
+            solo_prediccion: realiza un respaldo y comienza una nueva 
+                proyección reutilizando los modelos EP y ARIMA guardados de
+                las escuelas cuya matrícula no cambió, ver proyectar_escuela.
+        workers (int, opcional): número de procesos en los que se reparten las
+            escuelas. Por defecto es 1, es decir, las escuelas se proyectan una
+            tras otra en el proceso principal.
+        shard (str, opcional): parte de las escuelas a proyectar con el 
+            formato "i/N", donde N es el número de equipos entre los que se
+            divide la proyección e i (entre 1 y N) es la parte que proyecta 
+            este equipo. La proyección de la parte se guarda en el archivo
+            .ProyeccionMatricula_parte_i_de_N.csv. Las partes se unen con el
+            comando fusionar_proyecciones. No se puede utilizar con el modo
+            incremental.
+        presupuesto_ep (float, opcional): segundos disponibles para proyectar
+            cada escuela con EP. Si se proporciona, EP comienza con el experto
+            más barato y solo agrega expertos más costosos mientras se espere
+            que cambien la predicción en más de tolerancia_ep y quepan en el
+            presupuesto. Los expertos utilizados se registran en la columna
+            expertos del archivo de proyección. Por defecto se utilizan todos
+            los expertos.
+        tolerancia_ep (float, opcional): cambio relativo mínimo esperado de la
+            predicción de EP para agregar un experto, por defecto es 0.01 (1%
+            de la matrícula promedio de la escuela).
+        timeout_ep (float, opcional): segundos que se espera a los expertos de
+            EP de cada escuela, ver proyectar_escuela. Requiere 
+            expertos_concurrentes y no se puede utilizar junto con 
+            presupuesto_ep.
+        arranque_en_caliente (bool, opcional): si es True los modelos EP y 
+            ARIMA guardados se utilizan como punto de partida de las escuelas
+            que se vuelven a entrenar, ver proyectar_escuela. Por defecto es
+            False, los modelos se entrenan desde cero.
+        lote_ep (int, opcional): número de escuelas EP cuyas redes neuronales
+            se entrenan juntas, ver proyectar_lote. No se puede utilizar junto
+            con presupuesto_ep ni timeout_ep. Por defecto cada red se entrena 
+            por separado.
+        expertos_concurrentes (bool, opcional): si es True los expertos de EP
+            de cada escuela se ejecutan de forma concurrente en un pool de 
+            procesos, ver pool_expertos. Solo se puede utilizar con workers=1
+            y sin presupuesto_ep. Por defecto es False.
     """
     
-    if modo not in ["reanudar", "nueva_proyeccion", "forzar_nueva_proyeccion"] :
+    if modo not in ["reanudar", "nueva_proyeccion", "forzar_nueva_proyeccion", "incremental", "solo_prediccion"] :
         raise TypeError
     
     try :
-        f = open("DatosGenerales.json")
-        escuelas = json.load(f)['result'][0]
-        
-        # Borrar registros que no son escuelas
-        if '@type' in escuelas :
-            escuelas.pop('@type')
-        if '@version' in escuelas :
-            escuelas.pop('@version')
-        
+        workers = int(workers)
+    except ValueError :
+        raise TypeError
+    if workers < 1 :
+        raise TypeError
+    
+    try :
+        if presupuesto_ep is not None :
+            presupuesto_ep = float(presupuesto_ep)
+        tolerancia_ep = float(tolerancia_ep)
+        if timeout_ep is not None :
+            timeout_ep = float(timeout_ep)
+    except ValueError :
+        raise TypeError
+    if (presupuesto_ep is not None and presupuesto_ep <= 0) or tolerancia_ep < 0 :
+        raise TypeError
+    if timeout_ep is not None and (timeout_ep <= 0 or presupuesto_ep is not None) :
+        raise TypeError
+    
+    # Los parámetros de la línea de comandos se reciben como texto
+    if expertos_concurrentes not in [True, False, "True", "False"] :
+        raise TypeError
+    expertos_concurrentes = expertos_concurrentes in [True, "True"]
+    # Los procesos de los workers no pueden crear el pool de los expertos
+    if expertos_concurrentes and (workers != 1 or presupuesto_ep is not None) :
+        raise TypeError
+    if timeout_ep is not None and not expertos_concurrentes :
+        raise TypeError
+    
+    if lote_ep is not None :
+        try :
+            lote_ep = int(lote_ep)
+        except ValueError :
+            raise TypeError
+        if lote_ep < 1 or presupuesto_ep is not None or timeout_ep is not None :
+            raise TypeError
+    
+    # Los parámetros de la línea de comandos se reciben como texto
+    if arranque_en_caliente not in [True, False, "True", "False"] :
+        raise TypeError
+    arranque_en_caliente = arranque_en_caliente in [True, "True"]
+    
+    if shard is None :
+        archivo_proyeccion = ".ProyeccionMatricula.csv"
+    else :
+        try :
+            parte, num_partes = map(int, shard.split('/'))
+        except ValueError :
+            raise TypeError
+        if not 1 <= parte <= num_partes :
+            raise TypeError
+        if modo == "incremental" :
+            print("El modo incremental no está disponible al proyectar por partes")
+            return
+        archivo_proyeccion = archivo_parte(parte, num_partes)
+    
+    try :
+        escuelas = cargar_datos_generales()
     except FileNotFoundError :
         info = """
         No se encontró el archivo DatosGenerales.json, para obtenerlo ejecuta el siguiente comando:
@@ -245,109 +1310,205 @@ def actualizar_proyeccion(modo = "reanudar") :
         else :
             modo = "forzar_nueva_proyeccion"
     
-    if modo == "forzar_nueva_proyeccion" :
-        # Crear un respaldo de los datos actuales si es que existen
+    renglones_anteriores = dict()
+    if modo == "incremental" :
+        # Cargar las huellas de la última proyección completa
         try :
-            csv_proyeccion_matricula = open(".ProyeccionMatricula.csv", "r")
+            with open(".ManifiestoProyeccion.json", "r") as archivo_manifiesto :
+                manifiesto_anterior = json.load(archivo_manifiesto)
         except FileNotFoundError :
-            print("No se encontró ningún archivo con información previa de proyección de matrícula")
-            print("Omitiendo respaldo")
-        else :
-            now = datetime.now()
-            nombre_nuevo_respaldo = "Respaldo_%02d-%02d-%02d_%02d:%02d:%02d.csv" % (
-                now.day, 
-                now.month, 
-                now.year, 
-                now.hour, 
-                now.minute, 
-                now.second
-            )
-            if not os.path.exists('.respaldos_proyeccion') :
-                os.makedirs('.respaldos_proyeccion')
-            nuevo_respaldo = open(".respaldos_proyeccion/%s" % (nombre_nuevo_respaldo), "w+")
-            nuevo_respaldo.write(csv_proyeccion_matricula.read())
-            nuevo_respaldo.close()
-            csv_proyeccion_matricula.close()
-            print("Respaldo realizado con nombre %s" % (nombre_nuevo_respaldo))
-        
-        # Crear nuevo archivo .ProyeccionMatricula.csv
-        csv_proyeccion_matricula = open(".ProyeccionMatricula.csv", "w+")
+            print("No se encontró el archivo .ManifiestoProyeccion.json de una proyección completa previa")
+            print("Se proyectarán todas las escuelas")
+            manifiesto_anterior = dict()
+        
+        ruta_respaldo = respaldar_proyeccion(".ProyeccionMatricula.csv")
+        if ruta_respaldo :
+            renglones_anteriores, _ = leer_renglones_proyeccion(ruta_respaldo)
+        
+    elif modo in ["forzar_nueva_proyeccion", "solo_prediccion"] :
+        # Crear un respaldo de los datos actuales si es que existen
+        respaldar_proyeccion(archivo_proyeccion)
+    
+    if modo in ["forzar_nueva_proyeccion", "incremental", "solo_prediccion"] :
+        # El manifiesto solo describe proyecciones completas
+        if shard is None and os.path.exists(".ManifiestoProyeccion.json") :
+            os.remove(".ManifiestoProyeccion.json")
+        
+        # Crear nuevo archivo de proyección
+        csv_proyeccion_matricula = open(archivo_proyeccion, "w+")
         csv_proyeccion_matricula.write('')
         csv_proyeccion_matricula.close()
+        if os.path.exists(archivo_proyeccion + ".huellas") :
+            os.remove(archivo_proyeccion + ".huellas")
         print("Nuevo archivo de proyección de matrícula creado")
     
-    # Contar el número de lineas en el archivo para retomar trabajo previo
-    num_lines = 0
-    with open(".ProyeccionMatricula.csv", 'r') as csv_proyeccion_matricula :
-        for line in csv_proyeccion_matricula :
-            num_lines += 1
+    # Cargar la bitácora para retomar trabajo previo
+    bitacora = BitacoraProyeccion(archivo_proyeccion)
     
-    csv_proyeccion_matricula = open(".ProyeccionMatricula.csv", "a+")
+    ccts = list(escuelas.keys())
+    huellas = {cct : huella_escuela(escuelas[cct]) for cct in ccts}
     
-    if num_lines == 0 :
-        # Insertar cabecera al nuevo archivo
-        csv_proyeccion_matricula.write("cct,proyeccion_1,proyeccion_2,proyeccion_3,proyeccion_4,proyeccion_5,mae,rmse,mape,rp,metodo\n")
-        num_lines = 1
+    if shard is not None :
+        ccts = [cct for cct in ccts if parte_escuela(cct, num_partes) == parte]
+        print("Proyectando la parte %d/%d" % (parte, num_partes))
     
-    ccts = list(escuelas.keys())
-    print("Total de escuelas: %d" % (len(escuelas)))
-    print("Empezando en la escuela %d" % (num_lines))
+    if modo == "incremental" :
+        # Copiar los renglones de las escuelas que no cambiaron
+        copiadas = 0
+        for cct in ccts :
+            if cct in renglones_anteriores and manifiesto_anterior.get(cct) == huellas[cct] :
+                bitacora.registrar_linea(cct, renglones_anteriores[cct], huellas[cct])
+                copiadas += 1
+        bitacora.vaciar()
+        print("Escuelas sin cambios copiadas del respaldo: %d" % (copiadas))
     
-    from Proyeccion.Metodos.ExpertsOpinion import evaluate_and_predict_ep
-    from Proyeccion.Metodos.AutoARIMA import evaluate_and_predict_arima
-    from Proyeccion.Metodos.LinearRegression import evaluate_and_predict_slr
+    pendientes = [cct for cct in ccts if cct not in bitacora.completadas]
+    terminadas = len(ccts) - len(pendientes)
+    print("Total de escuelas: %d" % (len(ccts)))
+    print("Escuelas proyectadas previamente: %d" % (terminadas))
     
-    for i in range(num_lines - 1, len(escuelas)) :
-        cct = ccts[i]
-        matricula = np.array(escuelas[cct]['matricula'])
-        matricula_por_grupo = escuelas[cct]['prom_alumnos_grupo']
-        
-        # Obtener predicción futura e histórica
-        if len(matricula) > 8 :
-            proy_matricula_futura, proy_matricula_historica = evaluate_and_predict_ep(matricula)
-            matricula_historica_real = matricula[5:]
-            metodo = 'EP'
-        elif len(matricula) > 4 :
-            proy_matricula_futura, proy_matricula_historica = evaluate_and_predict_arima(matricula, OFFSET_ANIOS = 0)
-            matricula_historica_real = matricula
-            metodo = 'ARIMA'
-        elif len(matricula) > 1 :
-            proy_matricula_futura, proy_matricula_historica = evaluate_and_predict_slr(matricula)
-            matricula_historica_real = matricula
-            metodo = 'SLR'
-        else :
-            proy_matricula_futura = np.array([matricula[0]] * 5)
-            proy_matricula_historica = np.array(matricula)
-            matricula_historica_real = matricula
-            metodo = 'NF'
-        
-        # Calcular los errores
-        mae = np.abs(proy_matricula_historica - matricula_historica_real).mean()
-        rmse = np.sqrt(np.square(proy_matricula_historica - matricula_historica_real).mean())
-        mape = np.abs((proy_matricula_historica - matricula_historica_real) / matricula_historica_real).mean()
-        pr = (np.abs(proy_matricula_historica - matricula_historica_real) >= matricula_por_grupo).mean()
-        
-        proy_matricula_futura = proy_matricula_futura.astype(np.int)
-        
-        # Escribir nuevo renglón
-        csv_proyeccion_matricula.write("%s,%d,%d,%d,%d,%d,%.2lf,%.2lf,%.2lf,%.2lf,%s\n" % (
-            cct,
-            proy_matricula_futura[0],
-            proy_matricula_futura[1],
-            proy_matricula_futura[2],
-            proy_matricula_futura[3],
-            proy_matricula_futura[4],
-            mae,
-            rmse,
-            mape,
-            pr,
-            metodo
-        ))
+    tareas = [
+        (cct, escuelas[cct]['matricula'], escuelas[cct]['prom_alumnos_grupo'])
+        for cct in pendientes
+    ]
+    
+    # Repartir primero las escuelas más costosas
+    lotes = planificar_tareas(tareas, tam_lote_ep = lote_ep or 1)
+    
+    proyectar = functools.partial(
+        proyectar_lote,
+        solo_prediccion = modo == "solo_prediccion",
+        presupuesto_ep = presupuesto_ep,
+        tolerancia_ep = tolerancia_ep,
+        timeout_ep = timeout_ep,
+        arranque_en_caliente = arranque_en_caliente,
+        lote_ep = lote_ep,
+        expertos_concurrentes = expertos_concurrentes
+    )
+    
+    if workers == 1 :
+        resultados = map(proyectar, lotes)
+    else :
+        from Proyeccion.Metodos.ThreadLimits import limit_threads
         
-        print("Escuela %d/%d terminada" % (i + 1, len(escuelas)))
+        print("Proyectando con %d procesos" % (workers))
+        # Cada proceso utiliza un solo hilo de las bibliotecas numéricas
+        pool = multiprocessing.Pool(processes = workers, initializer = limit_threads)
+        # La bitácora está indexada por cct, por lo que los resultados se
+        # pueden escribir en el orden en el que terminen
+        resultados = pool.imap_unordered(proyectar, lotes, chunksize = 1)
+    
+    try :
+        for renglones in resultados :
+            for renglon in renglones :
+                bitacora.registrar(renglon, huellas[renglon[0]])
+                terminadas += 1
+                print("Escuela %d/%d terminada (%s)" % (terminadas, len(ccts), renglon[0]))
+    finally :
+        bitacora.cerrar()
+        descartar_pool_expertos()
+        if workers != 1 :
+            pool.terminate()
+            pool.join()
+    
+    # Ordenar el archivo como en DatosGenerales.json, se descartan las escuelas
+    # que ya no se encuentran en los datos generales
+    bitacora.reescribir(ccts)
+    
+    if shard is None :
+        # Guardar las huellas de los datos con los que se calculó cada renglón.
+        # Al reanudar, los renglones de ejecuciones anteriores conservan la
+        # huella de los datos de esa ejecución
+        guardar_manifiesto(bitacora.manifiesto(ccts))
+        print("Todas las escuelas han sido proyectadas")
+    else :
+        print("Todas las escuelas de la parte %d/%d han sido proyectadas" % (parte, num_partes))
+        print("Copia el archivo %s al equipo en el que se fusionarán las partes" % (archivo_proyeccion))
 
-    csv_proyeccion_matricula.close()
-    print("Todas las escuelas han sido proyectadas")
+def fusionar_proyecciones(directorio = '.') :
+    """Une en el archivo .ProyeccionMatricula.csv las proyecciones parciales
+    generadas con actualizar_proyeccion shard="i/N". Antes de unirlas valida
+    que se encuentren todas las partes, que cada parte esté completa, que
+    ninguna escuela se encuentre en más de una parte y que las escuelas
+    correspondan a las del archivo DatosGenerales.json.
+    
+    Args:
+        directorio (str, opcional): directorio en el que se encuentran los 
+            archivos .ProyeccionMatricula_parte_i_de_N.csv. Por defecto es el 
+            directorio actual.
+    """
+    try :
+        escuelas = cargar_datos_generales()
+    except FileNotFoundError :
+        print("No se encontró el archivo DatosGenerales.json")
+        return
+    
+    # Encontrar los archivos de las partes
+    partes = dict()
+    totales = set()
+    for nombre in os.listdir(directorio) :
+        coincidencia = re.fullmatch(r"\.ProyeccionMatricula_parte_(\d+)_de_(\d+)\.csv", nombre)
+        if coincidencia :
+            parte, num_partes = int(coincidencia.group(1)), int(coincidencia.group(2))
+            partes[parte] = os.path.join(directorio, nombre)
+            totales.add(num_partes)
+    
+    if not partes :
+        print("No se encontraron archivos de proyecciones parciales en el directorio %s" % (directorio))
+        return
+    if len(totales) != 1 :
+        print("Error: se encontraron partes de divisiones distintas: %s" % (sorted(totales)))
+        return
+    
+    num_partes = totales.pop()
+    faltantes = [parte for parte in range(1, num_partes + 1) if parte not in partes]
+    if faltantes :
+        print("Error: faltan las partes %s de %d" % (faltantes, num_partes))
+        return
+    
+    # Validar y unir las partes
+    renglones = dict()
+    huellas = dict()
+    errores = []
+    for parte in range(1, num_partes + 1) :
+        renglones_parte, valido = leer_renglones_proyeccion(partes[parte])
+        huellas.update(leer_huellas(partes[parte] + ".huellas"))
+        if not valido :
+            errores.append("La parte %d contiene renglones incompletos o inválidos, o es de una versión anterior" % (parte))
+        
+        for cct, linea in renglones_parte.items() :
+            if cct in renglones :
+                errores.append("La escuela %s se encuentra en más de una parte" % (cct))
+            elif cct not in escuelas :
+                errores.append("La escuela %s de la parte %d no se encuentra en DatosGenerales.json" % (cct, parte))
+            elif parte_escuela(cct, num_partes) != parte :
+                errores.append("La escuela %s no pertenece a la parte %d" % (cct, parte))
+            renglones[cct] = linea
+        
+        print("Parte %d/%d: %d escuelas" % (parte, num_partes, len(renglones_parte)))
+    
+    sin_proyeccion = [cct for cct in escuelas if cct not in renglones]
+    if sin_proyeccion :
+        errores.append("%d escuelas no tienen proyección, por ejemplo: %s" % (
+            len(sin_proyeccion), 
+            ', '.join(sin_proyeccion[:5])
+        ))
+    
+    if errores :
+        print("No se realizó la fusión de las proyecciones:")
+        for error in errores :
+            print("- %s" % (error))
+        return
+    
+    respaldar_proyeccion(".ProyeccionMatricula.csv")
+    escribir_proyeccion(".ProyeccionMatricula.csv", renglones, list(escuelas.keys()))
+    
+    # Las huellas son las de los datos con los que se proyectó cada parte. Las
+    # escuelas sin huella se proyectarán de nuevo en el modo incremental
+    huellas = {cct : huellas[cct] for cct in escuelas if cct in huellas}
+    escribir_huellas(".ProyeccionMatricula.csv.huellas", huellas)
+    guardar_manifiesto(huellas)
+    print("Proyecciones fusionadas en el archivo .ProyeccionMatricula.csv")
 
 def actualizar_datos_estado() :
     """Genera el archivo DatosEscuelas.json el cual contiene los datos generales
@@ -355,6 +1516,8 @@ def actualizar_datos_estado() :
     consumido por la aplicación de Dash en el directorio AppDash/.
     """
     
+    import pandas as pd
+    
     try :
         csv_proyeccion_matricula = pd.read_csv(".ProyeccionMatricula.csv")
         f = open("DatosGenerales.json", "r")
@@ -389,6 +1552,8 @@ def actualizar_datos_estado() :
             "mape" : row[8],
             "rp" : row[9],
             "metodo" : row[10],
+            # Los archivos de versiones anteriores no tienen la columna expertos
+            "expertos" : row[11] if len(row) > 11 else expertos_metodo(row[10]),
             "PAG" : escuelas[cct]["prom_alumnos_grupo"],
             "nombre" : escuelas[cct]["nombre"],
             "nivel" : escuelas[cct]["nivel"],
@@ -551,7 +1716,7 @@ def actualizar_datos_estado() :
                 conjunto[elemento]['primer_anio'] = 1998
         
         # Realizar la predicción de los datos
-        from Proyeccion.Metodos.ExpertsOpinion import evaluate_and_predict_ep
+        evaluate_and_predict_ep = cargar_metodo('EP')
         contador_elementos = 1
         
         print("Comenzando predicción")
@@ -567,7 +1732,7 @@ def actualizar_datos_estado() :
             rmse = np.sqrt(np.square(proy_matricula_historica - matricula_historica_real).mean())
             mape = np.abs((proy_matricula_historica - matricula_historica_real) / matricula_historica_real).mean()
             
-            proy_matricula_futura = proy_matricula_futura.astype(np.int)
+            proy_matricula_futura = proy_matricula_futura.astype(np.int64)
             
             # Asignar los valores
             conjunto[elemento]['pred'] = list(map(int, proy_matricula_futura))
@@ -613,6 +1778,67 @@ def actualizar_datos_estado() :
         json.dump(DatosEscuelas, outfile, separators=(',', ':')) 
     print("Datos guardados en el archivo AppDash/DatosEscuelas.json")
 
+def medir_inicio(repeticiones = 3) :
+    """Mide el tiempo de importación de este script y de los módulos que 
+    necesita cada comando. Cada medición se realiza en un nuevo proceso de
+    Python para que los módulos no se encuentren importados previamente.
+    
+    Args:
+        repeticiones (int, opcional): número de veces que se repite cada 
+            medición, se reporta el menor tiempo.
+    """
+    try :
+        repeticiones = int(repeticiones)
+    except ValueError :
+        raise TypeError
+    if repeticiones < 1 :
+        raise TypeError
+    
+    modulo_metodo = lambda nombre : METODOS_PROYECCION[nombre][0]
+    proyeccion_baratos = [modulo_metodo('SLR_LOTES'), modulo_metodo('NF_LOTES'), 'Proyeccion.Metodos.Metrics']
+    
+    # Módulos que importa cada comando además de este script
+    mediciones = [
+        ("info", []),
+        ("actualizar_datos_generales", ['requests', 'getpass']),
+        ("fusionar_proyecciones", []),
+        ("actualizar_proyeccion (SLR y NF)", proyeccion_baratos),
+        ("actualizar_proyeccion (ARIMA)", proyeccion_baratos + [modulo_metodo('ARIMA')]),
+        ("actualizar_proyeccion (EP)", proyeccion_baratos + [modulo_metodo('EP')]),
+        ("entrenamiento de la ANN (EP)", ['tensorflow']),
+        ("actualizar_datos_estado", ['pandas', modulo_metodo('EP')]),
+    ]
+    
+    codigo = (
+        "import time, importlib\n"
+        "inicio = time.perf_counter()\n"
+        "import UpdateScript\n"
+        "for modulo in %r :\n"
+        "    importlib.import_module(modulo)\n"
+        "print(time.perf_counter() - inicio)\n"
+    )
+    directorio = os.path.dirname(os.path.abspath(__file__))
+    
+    print("%-40s %s" % ("Comando", "Tiempo de importación (s)"))
+    for comando, modulos in mediciones :
+        tiempos = []
+        for _ in range(repeticiones) :
+            salida = subprocess.run(
+                [sys.executable, "-c", codigo % (modulos,)],
+                cwd = directorio,
+                stdout = subprocess.PIPE,
+                stderr = subprocess.DEVNULL,
+                universal_newlines = True
+            )
+            if salida.returncode != 0 :
+                break
+            tiempos.append(float(salida.stdout.strip().split('\n')[-1]))
+        
+        if tiempos :
+            print("%-40s %.3f" % (comando, min(tiempos)))
+        else :
+            print("%-40s %s" % (comando, "error al importar"))
+
 def comando_no_encontrado() :
     info = """
     No se encontró el comando especificado.
@@ -621,7 +1847,9 @@ def comando_no_encontrado() :
     - info
     - actualizar_datos_generales
     - actualizar_proyeccion
+    - fusionar_proyecciones
     - actualizar_datos_estado
+    - medir_inicio
 
     Uso:
 
@@ -651,8 +1879,12 @@ def cargar_comando() :
         return actualizar_datos_generales
     elif comando == "actualizar_proyeccion" :
         return actualizar_proyeccion
+    elif comando == "fusionar_proyecciones" :
+        return fusionar_proyecciones
     elif comando == "actualizar_datos_estado" :
         return actualizar_datos_estado
+    elif comando == "medir_inicio" :
+        return medir_inicio
     else :
         return comando_no_encontrado
 